@@ -1,6 +1,15 @@
 import sys
 import os
 import math
+import gzip
+import glob
+import csv
+import json
+import time
+import queue
+import signal
+import multiprocessing
+from array import array
 from collections import namedtuple
 from docplex.cp.model import CpoModel, CpoParameters
 
@@ -29,9 +38,13 @@ class CVRPTWProblem:
         self.service_time = []
         self._xy = None
 
-    def read_elem(self, filename):
-        with open(filename) as f:
-            return [str(elem) for elem in f.read().split()]
+    def iter_elems(self, filename):
+        # Tokens are produced line by line, the file is never loaded as a whole.
+        # Files ending with '.gz' are read through gzip.
+        opener = gzip.open if filename.endswith('.gz') else open
+        with opener(filename, 'rt') as f:
+            for line in f:
+                yield from line.split()
 
     # The input files follow the "Solomon" format.
     def read(self, filename):
@@ -40,38 +53,39 @@ class CVRPTWProblem:
             for _ in range(n):
                 next(file_it)
 
-        file_it = iter(self.read_elem(filename))
+        file_it = self.iter_elems(filename)
 
-        skip_elems(4)
+        try:
+            skip_elems(4)
 
-        self.nb_trucks = int(next(file_it))
-        self.truck_capacity = int(next(file_it))
+            self.nb_trucks = int(next(file_it))
+            self.truck_capacity = int(next(file_it))
 
-        skip_elems(13)
+            skip_elems(13)
 
-        self.depot_xy = (int(next(file_it)), int(next(file_it)))
+            self.depot_xy = (int(next(file_it)), int(next(file_it)))
 
-        skip_elems(2)
+            skip_elems(2)
 
-        self.max_horizon = int(next(file_it))
+            self.max_horizon = int(next(file_it))
 
-        skip_elems(1)
+            skip_elems(1)
+        except StopIteration:
+            raise ValueError('{}: unexpected end of file'.format(filename)) from None
 
-        idx = 0
-        while True:
-            val = next(file_it, None)
-            if val is None: break
-            idx = int(val) - 1
-            self.customers_xy.append((int(next(file_it)), int(next(file_it))))
-            self.demands.append(int(next(file_it)))
-            ready = int(next(file_it))
-            due = int(next(file_it))
-            stime = int(next(file_it))
-            self.earliest_start.append(ready)
-            self.latest_start.append(due)
-            self.service_time.append(stime)
+        # Customer rows: number, x, y, demand, ready time, due date, service time.
+        # Remaining tokens are parsed straight into a typed buffer, then split in one typed array per column.
+        rows = array('q', map(int, file_it))
+        if len(rows) % 7 != 0:
+            raise ValueError('{}: truncated customer data'.format(filename))
 
-        self.nb_customers = idx + 1
+        self.customers_xy = list(zip(rows[1::7], rows[2::7]))
+        self.demands = rows[3::7]
+        self.earliest_start = rows[4::7]
+        self.latest_start = rows[5::7]
+        self.service_time = rows[6::7]
+
+        self.nb_customers = rows[-7] if rows else 0
         self._xy = [self.depot_xy] + self.customers_xy
 
     def get_num_nodes(self): return self.nb_customers + 1
@@ -87,32 +101,32 @@ class CVRPTWProblem:
         assert i < self.get_num_nodes()
         if i == 0:
             return 0
-        return self.demands[i - 1]
+        return int(self.demands[i - 1])
 
     def get_service_time(self, i):
         assert i >= 0
         assert i < self.get_num_nodes()
         if i == 0:
             return 0
-        return TIME_FACTOR * self.service_time[i - 1]
+        return TIME_FACTOR * int(self.service_time[i - 1])
 
     def get_earliest_start(self, i):
         assert i >= 0
         assert i < self.get_num_nodes()
         if i == 0:
             return 0
-        return TIME_FACTOR * self.earliest_start[i - 1]
+        return TIME_FACTOR * int(self.earliest_start[i - 1])
 
     def get_latest_start(self, i):
         assert i >= 0
         assert i < self.get_num_nodes()
         if i == 0:
             return 0
-        return TIME_FACTOR * self.latest_start[i - 1]
+        return TIME_FACTOR * int(self.latest_start[i - 1])
 
     def _get_distance(self, from_, to_):
         c1, c2 = self._xy[from_], self._xy[to_]
-        dx, dy, d = c2[0] - c1[0], c2[1] - c1[1], 0.0
+        dx, dy, d = int(c2[0] - c1[0]), int(c2[1] - c1[1]), 0.0
         d = math.sqrt(dx * dx + dy * dy)
         return int(math.floor(d * TIME_FACTOR))
 
@@ -123,6 +137,16 @@ class CVRPTWProblem:
         assert to_ < self.get_num_nodes()
         return self._get_distance(from_, to_)
 
+    def get_distance_matrix(self):
+        # Same rounding as _get_distance, computed for all node pairs at once:
+        # squared distances are exact integers, so sqrt and floor match math.sqrt/math.floor.
+        import numpy as np
+        xy = np.array(self._xy, dtype=np.int64)
+        dx = xy[np.newaxis, :, 0] - xy[:, np.newaxis, 0]
+        dy = xy[np.newaxis, :, 1] - xy[:, np.newaxis, 1]
+        d = np.sqrt(dx * dx + dy * dy)
+        return np.floor(d * TIME_FACTOR).astype(np.int64)
+
 
 class VRP:
     VisitData = namedtuple("CustomerData", "demand service_time earliest, latest")
@@ -142,18 +166,16 @@ class VRP:
         self._capacity = pb.get_capacity()
 
         # Node mapping
-        pnode = [i + 1 for i in range(self._num_cust)] + [0] * (2 * self._num_veh)
+        import numpy as np
+        pnode = np.array([i + 1 for i in range(self._num_cust)] + [0] * (2 * self._num_veh), dtype=np.intp)
 
         # Visit data
         self._visit_data = \
             tuple(VRP.VisitData(pb.get_demand(pnode[c]), pb.get_service_time(pnode[c]), pb.get_earliest_start(pnode[c]), pb.get_latest_start(pnode[c])) for c in self._cust) + \
             tuple(VRP.VisitData(0, 0, 0, self._max_horizon) for _ in self._first + self._last)
 
-        # Distance
-        self._distance = [
-          [ pb.get_distance(pnode[i], pnode[j]) for j in range(self._n) ]
-          for i in range(self._n)
-        ]
+        # Distance: contiguous int matrix, row i holds distances from visit i
+        self._distance = np.ascontiguousarray(pb.get_distance_matrix()[np.ix_(pnode, pnode)])
 
     def first(self) : return self._first
     def last(self) : return self._last
@@ -171,7 +193,8 @@ class VRP:
     def get_service_time(self, i): return self._visit_data[i].service_time
     def get_earliest_start(self, i): return self._visit_data[i].earliest
     def get_latest_start(self, i): return self._visit_data[i].latest
-    def get_distance(self, i, j): return self._distance[i][j]
+    def get_distance(self, i, j): return int(self._distance[i, j])
+    def get_distance_matrix(self): return self._distance
 
 
 class DataModel:
@@ -180,6 +203,7 @@ class DataModel:
     veh = None
     load = None
     start_time = None
+    used = None
     params = None
 
 
@@ -223,19 +247,22 @@ def build_model(cvrp_prob, tlim):
     demand = [ vrp.get_demand(c) for c in vrp.customers() ]
     mdl.add(mdl.pack(load, cust_veh, demand, used))
 
+    # Distances to each visit, one row per visit (transpose of the from/to matrix)
+    dist_to = vrp.get_distance_matrix().T
+
     # Time
     start_time = [ mdl.integer_var(vrp.get_earliest_start(i), vrp.get_latest_start(i), "T{}".format(i)) for i in range(n) ]
     for fv in vrp.first():
         mdl.add(start_time[fv] == 0)
     for i in vrp.customers() + vrp.last():
-        arrive = mdl.element([start_time[j] + vrp.get_service_time(j) + vrp.get_distance(j, i) for j in range(n)], prev[i])
+        ldist = dist_to[i].tolist()
+        arrive = mdl.element([start_time[j] + vrp.get_service_time(j) + ldist[j] for j in range(n)], prev[i])
         mdl.add(start_time[i] == mdl.max(arrive, vrp.get_earliest_start(i)))
 
     # Distance
     all_dist = []
     for i in vrp.customers() + vrp.last():
-        ldist = [ vrp.get_distance(j, i) for j in range(n) ]
-        all_dist.append(mdl.element(ldist, prev[i]))
+        all_dist.append(mdl.element(dist_to[i].tolist(), prev[i]))
     total_distance = mdl.sum(all_dist) / TIME_FACTOR
 
     # Variables with inferred values
@@ -261,6 +288,7 @@ def build_model(cvrp_prob, tlim):
     data.veh = veh
     data.load = load
     data.start_time = start_time
+    data.used = used
     data.params = params
 
     return mdl, data
@@ -305,11 +333,167 @@ def display_solution(sol, data):
             print(" empty")
 
 
+# -----------------------------------------------------------------------------
+# Batch mode: solve every instance of a directory (or glob) in parallel
+# -----------------------------------------------------------------------------
+
+BATCH_FIELDS = ('instance', 'status', 'objective', 'vehicles', 'solve_time')
+
+
+def list_instances(pattern):
+    """ Returns the sorted list of instance files of a directory, or matching a glob pattern. """
+    if os.path.isdir(pattern):
+        pattern = os.path.join(pattern, '*')
+    return sorted(f for f in glob.glob(pattern) if os.path.isfile(f))
+
+
+def solve_instance(fname, tlim, workers=1):
+    """ Reads, builds and solves one instance, and returns its results row as a dict.
+
+    A file that cannot be parsed is reported with a 'Malformed' status.
+    """
+    row = dict.fromkeys(BATCH_FIELDS)
+    row['instance'] = fname
+    try:
+        cvrptw_prob = CVRPTWProblem()
+        try:
+            cvrptw_prob.read(fname)
+        except ValueError as e:
+            row['status'] = 'Malformed: {}'.format(e)
+            return row
+        model, data_model = build_model(cvrptw_prob, tlim)
+        solution = model.solve(Workers=workers, LogVerbosity='Quiet')
+        row['status'] = solution.get_solve_status()
+        row['solve_time'] = solution.get_solve_time()
+        if solution:
+            row['objective'] = solution.get_objective_value()
+            row['vehicles'] = solution.solution[data_model.used]
+    except Exception as e:
+        message = str(e).strip().splitlines()
+        row['status'] = 'Error: {}{}'.format(type(e).__name__, ': ' + message[0] if message else '')
+    return row
+
+
+def _batch_worker(fname, tlim, results):
+    if hasattr(os, 'setpgrp'):
+        # Own process group, shared with the solver subprocess, so that both are killed on timeout
+        os.setpgrp()
+    results.put(solve_instance(fname, tlim))
+
+
+def _kill_worker(proc):
+    # Kills a worker process and the solver subprocess it started (on POSIX systems;
+    # elsewhere, the solver ends when its connection to the killed worker closes)
+    if hasattr(os, 'killpg'):
+        try:
+            os.killpg(proc.pid, signal.SIGKILL)
+            return
+        except ProcessLookupError:
+            # the worker has not created its process group yet
+            pass
+    proc.kill()
+
+
+def _open_results_writer(out):
+    # Rows go to a CSV file, or to a JSON-lines file if the name ends with '.jsonl'
+    if out.endswith('.jsonl'):
+        def write(row):
+            out_file.write(json.dumps(row) + '\n')
+            out_file.flush()
+    else:
+        writer = None
+
+        def write(row):
+            nonlocal writer
+            if writer is None:
+                writer = csv.DictWriter(out_file, fieldnames=BATCH_FIELDS)
+                writer.writeheader()
+            writer.writerow(row)
+            out_file.flush()
+    out_file = open(out, 'w', newline='')
+    return out_file, write
+
+
+def solve_batch(fnames, out, tlim, nb_workers=None, grace=10):
+    """ Solves a list of instances in a pool of worker processes.
+
+    Each instance runs in its own process with a solver time limit of tlim seconds;
+    a process still running tlim + grace seconds after its start is killed, with its
+    solver process, and reported with a 'Timeout' status, so that neither slow nor failing instances
+    block the others. One results row per instance is written to out as soon as
+    it is available.
+    """
+    if nb_workers is None:
+        nb_workers = os.cpu_count() or 1
+    ctx = multiprocessing.get_context('spawn')
+    results = ctx.Queue()
+    pending = list(fnames)
+    running = {}  # instance -> (process, start time)
+    done = {}
+    out_file, write = _open_results_writer(out)
+
+    def collect(timeout):
+        try:
+            row = results.get(timeout=timeout)
+        except queue.Empty:
+            return
+        done[row['instance']] = row
+        write(row)
+
+    with out_file:
+        while pending or running:
+            while pending and len(running) < nb_workers:
+                fname = pending.pop(0)
+                proc = ctx.Process(target=_batch_worker, args=(fname, tlim, results), daemon=True)
+                proc.start()
+                running[fname] = (proc, time.time())
+
+            collect(timeout=0.5)
+
+            for fname, (proc, start) in list(running.items()):
+                if fname in done:
+                    proc.join()
+                    del running[fname]
+                elif not proc.is_alive():
+                    # The row may still be in flight: drain the queue before giving up
+                    while not results.empty():
+                        collect(timeout=0.1)
+                    if fname not in done:
+                        row = dict.fromkeys(BATCH_FIELDS, None)
+                        row.update(instance=fname, status='Failed (exit code {})'.format(proc.exitcode))
+                        done[fname] = row
+                        write(row)
+                    del running[fname]
+                elif time.time() - start > tlim + grace:
+                    _kill_worker(proc)
+                    proc.join()
+                    row = dict.fromkeys(BATCH_FIELDS, None)
+                    row.update(instance=fname, status='Timeout', solve_time=time.time() - start)
+                    done[fname] = row
+                    write(row)
+                    del running[fname]
+
+    return [done[f] for f in fnames]
+
+
 if __name__ == "__main__":
+    if len(sys.argv) >= 2 and sys.argv[1] == '--batch':
+        if len(sys.argv) not in (4, 5):
+            print(f'Usage: {sys.argv[0]} --batch <directory or glob> <results.csv or results.jsonl> [time limit]')
+            exit(1)
+        tlim = float(sys.argv[4]) if len(sys.argv) == 5 else 15
+        instances = list_instances(sys.argv[2])
+        print('Solving {} instances, time limit {:g}s per instance'.format(len(instances), tlim))
+        rows = solve_batch(instances, sys.argv[3], tlim)
+        for row in rows:
+            print('{instance}: {status}, objective={objective}, vehicles={vehicles}'.format(**row))
+        exit(0)
+
     fname = os.path.dirname(os.path.abspath(__file__)) + "/data/cvrptw_C101_25.data"
     if len(sys.argv) != 1:
-        if len(sys.argv) != 2:
-            print(f'Usage: {sys.argv[0]} OR {sys.argv[0]} <filename>')
+        if len(sys.argv) not in (2, 3):
+            print(f'Usage: {sys.argv[0]} OR {sys.argv[0]} <filename> [time limit]'
+                  f' OR {sys.argv[0]} --batch <directory or glob> <results.csv or results.jsonl> [time limit]')
             exit(1)
         else:
             fname = sys.argv[1]
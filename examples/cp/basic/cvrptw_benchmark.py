@@ -0,0 +1,109 @@
+"""
+Benchmarks for the CVRPTW example (cvrptw.py).
+
+Instances are synthetic files in the "Solomon" format, generated with a
+fixed seed so that runs are reproducible.
+
+Usage: python cvrptw_benchmark.py [nb_customers ...]
+"""
+
+import sys
+import os
+import gzip
+import random
+import tempfile
+import time
+import tracemalloc
+
+import cvrptw
+
+
+def write_instance(filename, nb_customers, nb_trucks=None, seed=0):
+    """ Writes a random instance in the Solomon format; gzip-compressed if filename ends with '.gz'. """
+    rnd = random.Random(seed)
+    if nb_trucks is None:
+        nb_trucks = max(1, nb_customers // 4)
+    horizon = 1000 + 2 * nb_customers
+    opener = gzip.open if filename.endswith('.gz') else open
+    with opener(filename, 'wt') as f:
+        f.write('SYN{}\n\nVEHICLE\nNUMBER     CAPACITY\n  {}         200\n\n'.format(nb_customers, nb_trucks))
+        f.write('CUSTOMER\nCUST NO.  XCOORD.   YCOORD.    DEMAND   READY TIME  DUE DATE   SERVICE   TIME\n \n')
+        f.write('{:5d} {:8d} {:10d} {:10d} {:10d} {:10d} {:10d}\n'.format(0, 500, 500, 0, 0, horizon, 0))
+        for c in range(1, nb_customers + 1):
+            ready = rnd.randint(0, horizon - 100)
+            f.write('{:5d} {:8d} {:10d} {:10d} {:10d} {:10d} {:10d}\n'.format(
+                c, rnd.randint(0, 1000), rnd.randint(0, 1000), rnd.randint(1, 40),
+                ready, ready + rnd.randint(20, 100), 10))
+
+
+def legacy_read(pb, filename):
+    """ Reader of cvrptw.py before streaming: the whole file is split into a list of strings. """
+    with open(filename) as f:
+        elems = [str(elem) for elem in f.read().split()]
+    file_it = iter(elems)
+    for _ in range(4):
+        next(file_it)
+    pb.nb_trucks = int(next(file_it))
+    pb.truck_capacity = int(next(file_it))
+    for _ in range(13):
+        next(file_it)
+    pb.depot_xy = (int(next(file_it)), int(next(file_it)))
+    for _ in range(2):
+        next(file_it)
+    pb.max_horizon = int(next(file_it))
+    next(file_it)
+    idx = 0
+    while True:
+        val = next(file_it, None)
+        if val is None: break
+        idx = int(val) - 1
+        pb.customers_xy.append((int(next(file_it)), int(next(file_it))))
+        pb.demands.append(int(next(file_it)))
+        pb.earliest_start.append(int(next(file_it)))
+        pb.latest_start.append(int(next(file_it)))
+        pb.service_time.append(int(next(file_it)))
+    pb.nb_customers = idx + 1
+    pb._xy = [pb.depot_xy] + pb.customers_xy
+
+
+def _run_reader(reader, filename, trace=False):
+    # With trace, returns the peak of memory allocated by Python during the parse, in MB;
+    # tracing slows allocations down, so timed runs are not traced.
+    pb = cvrptw.CVRPTWProblem()
+    if trace:
+        tracemalloc.start()
+    start = time.perf_counter()
+    if reader == 'legacy':
+        legacy_read(pb, filename)
+    else:
+        pb.read(filename)
+    elapsed = time.perf_counter() - start
+    peak = None
+    if trace:
+        peak = tracemalloc.get_traced_memory()[1] / (1024.0 * 1024.0)
+        tracemalloc.stop()
+    return pb.get_num_nodes() - 1, elapsed, peak
+
+
+def bench_read(sizes=(1000, 5000), repeat=3):
+    with tempfile.TemporaryDirectory() as tmpdir:
+        print('| {:>9} | {:<14} | {:>10} | {:>15} |'.format('customers', 'reader', 'time (ms)', 'peak alloc (MB)'))
+        for size in sizes:
+            fname = os.path.join(tmpdir, 'syn_{}.data'.format(size))
+            write_instance(fname, size)
+            write_instance(fname + '.gz', size)
+            runs = [('legacy', fname), ('streaming', fname), ('streaming', fname + '.gz')]
+            for reader, path in runs:
+                best_time = None
+                for _ in range(repeat):
+                    nb, elapsed, _ = _run_reader(reader, path)
+                    assert nb == size
+                    best_time = elapsed if best_time is None else min(best_time, elapsed)
+                _, _, peak = _run_reader(reader, path, trace=True)
+                name = reader + (' (gz)' if path.endswith('.gz') else '')
+                print('| {:>9} | {:<14} | {:>10.1f} | {:>15.2f} |'.format(size, name, 1000 * best_time, peak))
+
+
+if __name__ == "__main__":
+    sizes = [int(a) for a in sys.argv[1:]] or [1000, 5000]
+    bench_read(sizes)
@@ -7,24 +7,282 @@
 
 # This file shows how to connect CPLEX branch callbacks to a DOcplex model.
 import math
+import threading
 import cplex
 import cplex.callbacks as cpx_cb
+import numpy as np
 
 from docplex.mp.callbacks.cb_mixin import *
 from docplex.mp.model import Model
 from collections import defaultdict, namedtuple
 
+from cb_stats import timed_call, enable_stats, stats_enabled
+
+
+# Scoring rules for the array-based selection of MyBranch.
+# A rule is called with the callback, the indices of fractional variables, their values and
+# their fractionality (distance to the nearest integer), as NumPy arrays; it returns one
+# score per candidate. The variable with the highest score is branched on; ties are
+# broken by largest absolute objective coefficient, as in the original loop.
+
+def most_fractional_score(cb, candidates, x, frac):
+    return frac
+
+
+def _pseudo_cost_product(pseudo_costs, x):
+    # product score: estimated degradations of both children, with a floor
+    # so that a zero pseudo-cost in one direction does not cancel the other
+    up, down = pseudo_costs
+    f_down = x - np.floor(x)
+    return np.maximum(f_down * down, 1e-6) * np.maximum((1 - f_down) * up, 1e-6)
+
+
+def pseudo_cost_score(cb, candidates, x, frac):
+    # pseudo-costs learnt by the callback, see PseudoCostStore
+    return _pseudo_cost_product(cb.pseudo_cost_store.pseudo_costs(candidates), x)
+
+
+def cplex_pseudo_cost_score(cb, candidates, x, frac):
+    pseudo_costs = np.asarray(cb.get_pseudo_costs(candidates.tolist()), dtype=np.float64).reshape(-1, 2).T
+    return _pseudo_cost_product(pseudo_costs, x)
+
+
+def strong_branching_lite_score(cb, candidates, x, frac, nb_top=8):
+    # limited strong branching: the nb_top candidates with the best pseudo-cost scores
+    # are scored by trial LP solves of their two children, see TrialLP; other candidates
+    # are not branched on
+    scores = np.full(len(candidates), -np.inf)
+    top = np.argsort(-pseudo_cost_score(cb, candidates, x, frac), kind='stable')[:nb_top]
+    up, down = cb.trial_lp.degradations(cb.get_thread_num(), cb.get_lower_bounds(), cb.get_upper_bounds(),
+                                        candidates[top], x[top])
+    scores[top] = np.maximum(up, 1e-6) * np.maximum(down, 1e-6)
+    return scores
+
+
+BRANCHING_RULES = {'most_fractional': most_fractional_score,
+                   'pseudo_cost': pseudo_cost_score,
+                   'cplex_pseudo_cost': cplex_pseudo_cost_score,
+                   'strong_branching_lite': strong_branching_lite_score}
+
+# rules that do not read the pseudo-costs learnt by the callback, which are then not recorded
+RULES_WITHOUT_STORE = (most_fractional_score, cplex_pseudo_cost_score)
+
+
+class PseudoCostStore(object):
+    """ Per-variable pseudo-costs, learnt from the objective change of child nodes.
+
+    For each variable and direction (up, down), stores the sum and count of objective
+    degradations per unit of bound change, in arrays indexed by variable index.
+
+    Callbacks may run in several threads: each thread records observations in its own
+    buffer, and adds them to the shared arrays every merge_every observations. All methods
+    hold a lock, only for a buffer append in `record`; reads may miss observations not merged yet.
+    """
+    UP, DOWN = 0, 1
+
+    def __init__(self, nb_vars, merge_every=32):
+        self.sums = np.zeros((2, nb_vars), dtype=np.float64)
+        self.counts = np.zeros((2, nb_vars), dtype=np.int64)
+        self.merge_every = merge_every
+        self._lock = threading.Lock()
+        self._buffers = {}
+
+    def record(self, thread_num, var_index, direction, degradation):
+        """ Records the degradation per unit change of branching on a variable in one direction. """
+        with self._lock:
+            buffer = self._buffers.setdefault(thread_num, [])
+            buffer.append((direction, var_index, degradation))
+            full = len(buffer) >= self.merge_every
+        if full:
+            self.merge(thread_num)
+
+    def merge(self, thread_num=None):
+        """ Adds the observations of one thread (default is all) to the shared arrays.
+
+        """
+        with self._lock:
+            thread_nums = list(self._buffers) if thread_num is None else [thread_num]
+            for t in thread_nums:
+                buffer = self._buffers[t]
+                if not buffer:
+                    continue
+                self._buffers[t] = []
+                directions, indices, degradations = zip(*buffer)
+                np.add.at(self.sums, (directions, indices), degradations)
+                np.add.at(self.counts, (directions, indices), 1)
+
+    def pseudo_costs(self, indices):
+        """ Returns the (up, down) arrays of pseudo-costs of variables.
+
+        Variables without observation in a direction get the mean pseudo-cost of the
+        others in that direction, or 1 if there is none.
+        """
+        with self._lock:
+            sums, counts = self.sums[:, indices], self.counts[:, indices]
+            known = self.counts > 0
+            nb_known = known.sum(axis=1)
+            means = np.where(nb_known > 0,
+                             (self.sums / np.maximum(self.counts, 1)).sum(axis=1) / np.maximum(nb_known, 1), 1.0)
+        return np.where(counts > 0, sums / np.maximum(counts, 1), means[:, None])
+
+
+class TrialLP(object):
+    """ LP relaxation of a model, for the trial solves of child nodes in strong branching.
+
+    Logical and indicator constraints are dropped, and the cuts of CPLEX nodes are not
+    known, so objective values differ from those of node LPs: only their changes are used.
+    Trial solves use dual simplex with an iteration limit. Callbacks may run in several
+    threads: each thread solves its own copy of the LP.
+    """
+
+    def __init__(self, cpx, iteration_limit=50):
+        self._lp = cplex.Cplex(cpx)
+        self._lp.set_problem_type(self._lp.problem_type.LP)
+        self.iteration_limit = iteration_limit
+        self._lock = threading.Lock()
+        self._copies = {}
+
+    def _get_copy(self, thread_num):
+        lp = self._copies.get(thread_num)
+        if lp is None:
+            with self._lock:
+                lp = cplex.Cplex(self._lp)
+                self._copies[thread_num] = lp
+            for set_stream in (lp.set_log_stream, lp.set_results_stream, lp.set_warning_stream):
+                set_stream(None)
+            lp.parameters.threads.set(1)
+            lp.parameters.lpmethod.set(lp.parameters.lpmethod.values.dual)
+            lp.parameters.simplex.limits.iterations.set(self.iteration_limit)
+        return lp
+
+    @staticmethod
+    def _objective(lp):
+        # None for an infeasible LP; when stopped at the iteration limit, dual simplex
+        # gives a bound on the objective
+        lp.solve()
+        if lp.solution.get_status() in (lp.solution.status.infeasible, lp.solution.status.unbounded):
+            return None
+        try:
+            return lp.solution.get_objective_value()
+        except cplex.exceptions.CplexError:
+            return None
+
+    def degradations(self, thread_num, lb, ub, indices, x):
+        """ Returns the (up, down) arrays of objective changes of branching on variables at a node.
+
+        :param lb: the node lower bounds of all variables, as returned by `get_lower_bounds()`
+        :param ub: the node upper bounds of all variables
+        :param indices: the indices of the variables to branch on, x their values at the node
+
+        An infeasible child has an infinite change.
+        """
+        lp = self._get_copy(thread_num)
+        lp.variables.set_lower_bounds(list(enumerate(lb)))
+        lp.variables.set_upper_bounds(list(enumerate(ub)))
+        changes = np.zeros((2, len(indices)))
+        base = self._objective(lp)
+        if base is None:
+            return changes
+        for k, (j, xj) in enumerate(zip(indices.tolist(), x.tolist())):
+            xj_lo = math.floor(xj)
+            lp.variables.set_lower_bounds(j, xj_lo + 1)
+            up = self._objective(lp)
+            lp.variables.set_lower_bounds(j, lb[j])
+            lp.variables.set_upper_bounds(j, xj_lo)
+            down = self._objective(lp)
+            lp.variables.set_upper_bounds(j, ub[j])
+            changes[:, k] = [np.inf if v is None else abs(v - base) for v in (up, down)]
+        return changes[PseudoCostStore.UP], changes[PseudoCostStore.DOWN]
+
 
 class MyBranch(ModelCallbackMixin, cpx_cb.BranchCallback):
 
     brtype_map = {'0': 'var', '1': 'sos1', '2': 'sos2', 'X': 'user'}
+    # set to False to skip printing one line per branch
+    verbose = True
+
     def __init__(self, env):
         # non public...
         cpx_cb.BranchCallback.__init__(self, env)
         ModelCallbackMixin.__init__(self)
         self.nb_called = 0
         self.stats = defaultdict(int)
-
+        self.nb_branches = 0
+        self._branching_rule = None
+        self._score = None
+        self._abs_obj = None
+        self.pseudo_cost_store = None
+        self.trial_lp = None
+
+    @property
+    def branching_rule(self):
+        """ None selects the variable with a Python loop over all columns, otherwise a name in
+        BRANCHING_RULES or a scoring function, evaluated on arrays.
+
+        Setting it sets up the array-based selection, see `reset_selector`.
+        """
+        return self._branching_rule
+
+    @branching_rule.setter
+    def branching_rule(self, rule):
+        self._branching_rule = rule
+        self.reset_selector()
+
+    def reset_selector(self):
+        """ Sets up the array-based selection: caches the objective coefficients, clears the pseudo-costs,
+        and copies the LP relaxation for strong branching.
+
+        This is done before solving, as callbacks may run in several threads. To be called
+        before solving again after changing the objective.
+        """
+        rule = self._branching_rule
+        if rule is None:
+            self._score = self._abs_obj = self.pseudo_cost_store = self.trial_lp = None
+            return
+        self._score = BRANCHING_RULES[rule] if isinstance(rule, str) else rule
+        cpx = self.model.get_cplex()
+        # objective coefficients do not change during a solve
+        self._abs_obj = np.abs(np.asarray(cpx.objective.get_linear(), dtype=np.float64))
+        if self._score in RULES_WITHOUT_STORE:
+            self.pseudo_cost_store = None
+        else:
+            self.pseudo_cost_store = PseudoCostStore(cpx.variables.get_num())
+        self.trial_lp = TrialLP(cpx) if self._score is strong_branching_lite_score else None
+
+    def update_pseudo_costs(self, objval):
+        # node data of a child: (var index, floor of its value, direction, parent objective, its value)
+        data = self.get_node_data()
+        if data is None or len(data) < 5:
+            return
+        j, xj_lo, direction, parent_objval, xj = data
+        if direction == "UP":
+            store_direction, change = PseudoCostStore.UP, xj_lo + 1 - xj
+        else:
+            store_direction, change = PseudoCostStore.DOWN, xj - xj_lo
+        if change > 1e-9:
+            self.pseudo_cost_store.record(self.get_thread_num(), j, store_direction,
+                                          abs(objval - parent_objval) / change)
+
+    def select_branching_var(self, x):
+        """ Returns the index of the variable to branch on, or -1 if there is none.
+
+        :param x: the node LP values of all variables, as returned by `get_values()`
+        """
+        feas = np.fromiter(self.get_feasibilities(), dtype=np.int64, count=len(x))
+        candidates = np.flatnonzero(feas == self.feasibility_status.infeasible)
+        if not len(candidates):
+            return -1
+        # values are read one by one from CPLEX: only those of candidates are converted
+        xc = np.array([x[j] for j in candidates.tolist()], dtype=np.float64)
+        frac = xc - np.floor(xc)
+        np.minimum(frac, 1.0 - frac, out=frac)
+        scores = np.asarray(self._score(self, candidates, xc, frac))
+        best = candidates[scores == scores.max()]
+        # largest objective coefficient, last index first, as in the loop
+        best_obj = self._abs_obj[best][::-1]
+        return int(best[len(best) - 1 - np.argmax(best_obj)])
+
+    @timed_call(payload_counter='nb_branches')
     def __call__(self):
         self.nb_called += 1
         br_type = self.get_branch_type()
@@ -35,41 +293,48 @@ class MyBranch(ModelCallbackMixin, cpx_cb.BranchCallback):
         x = self.get_values()
 
         objval = self.get_objective_value()
-        obj = self.get_objective_coefficients()
-        feas = self.get_feasibilities()
-
-        maxobj = -cplex.infinity
-        maxinf = -cplex.infinity
-        bestj = -1
-        infeas = self.feasibility_status.infeasible
-
-        for j in range(len(x)):
-            if feas[j] == infeas:
-                xj_inf = x[j] - math.floor(x[j])
-                if xj_inf > 0.5:
-                    xj_inf = 1.0 - xj_inf
-
-                if (xj_inf >= maxinf and
-                        (xj_inf > maxinf or abs(obj[j]) >= maxobj)):
-                    bestj = j
-                    maxinf = xj_inf
-                    maxobj = abs(obj[j])
+        if self.branching_rule is not None:
+            if self.pseudo_cost_store is not None:
+                self.update_pseudo_costs(objval)
+            bestj = self.select_branching_var(x)
+        else:
+            obj = self.get_objective_coefficients()
+            feas = self.get_feasibilities()
+
+            maxobj = -cplex.infinity
+            maxinf = -cplex.infinity
+            bestj = -1
+            infeas = self.feasibility_status.infeasible
+
+            for j in range(len(x)):
+                if feas[j] == infeas:
+                    xj_inf = x[j] - math.floor(x[j])
+                    if xj_inf > 0.5:
+                        xj_inf = 1.0 - xj_inf
+
+                    if (xj_inf >= maxinf and
+                            (xj_inf > maxinf or abs(obj[j]) >= maxobj)):
+                        bestj = j
+                        maxinf = xj_inf
+                        maxobj = abs(obj[j])
 
         if bestj < 0:
             return
 
         xj_lo = math.floor(x[bestj])
-        # the (bestj, xj_lo, direction) triple can be any python object to
-        # associate with a node
+        # node data can be any python object to associate with a node; here
+        # (bestj, xj_lo, direction, objval, x[bestj]), used to learn pseudo-costs
         dv = self.index_to_var(bestj)
         self.stats[dv] += 1
         # note that we convert the variable index to its docplex name
-        print('---> BRANCH[{0}]---  custom branch callback, branch type is {1}, var={2!s}'
-              .format(self.nb_called, self.brtype_map.get(br_type, '??'), dv))
+        if self.verbose:
+            print('---> BRANCH[{0}]---  custom branch callback, branch type is {1}, var={2!s}'
+                  .format(self.nb_called, self.brtype_map.get(br_type, '??'), dv))
         self.make_branch(objval, variables=[(bestj, "L", xj_lo + 1)],
-                         node_data=(bestj, xj_lo, "UP"))
+                         node_data=(bestj, xj_lo, "UP", objval, x[bestj]))
         self.make_branch(objval, variables=[(bestj, "U", xj_lo)],
-                         node_data=(bestj, xj_lo, "DOWN"))
+                         node_data=(bestj, xj_lo, "DOWN", objval, x[bestj]))
+        self.nb_branches += 2
 
     def report(self, n=5):
         sorted_stats = sorted(self.stats.items(), key=lambda p: p[1], reverse=True)
@@ -77,9 +342,13 @@ class MyBranch(ModelCallbackMixin, cpx_cb.BranchCallback):
             print('#{0} most branched: {1}, branched: {2}'.format(k, dv, occ))
 
 
-def add_branch_callback(docplex_model, logged=False):
+def add_branch_callback(docplex_model, logged=False, verbose=True, branching_rule=None):
     # register a class callback once!!!
     bcb = docplex_model.register_callback(MyBranch)
+    bcb.verbose = verbose
+    bcb.branching_rule = branching_rule
+    if stats_enabled():
+        enable_stats(bcb)
 
     docplex_model.parameters.mip.interval = 1
 
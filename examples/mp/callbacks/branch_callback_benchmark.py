@@ -0,0 +1,47 @@
+"""
+Benchmarks for the branch callback example (branch_callback.py).
+
+Solves the game of life model with the original branching loop and with each
+array-based scoring rule, with a time limit, and reports nodes, callback time
+and the final gap. Branch lines are not printed.
+
+Usage: python branch_callback_benchmark.py [time_limit [n ...]]
+"""
+
+import contextlib
+import io
+import sys
+import time
+
+from branch_callback import MyBranch, BRANCHING_RULES, build_lifegame_model
+from cb_stats import enable_stats
+
+
+def bench_branching_rules(sizes=(10, 12, 14), rules=(None,) + tuple(BRANCHING_RULES), time_limit=60):
+    print('| {:>3} | {:<21} | {:>6} | {:>6} | {:>8} | {:>8} | {:>10} | {:>14} | {:>8} |'.format(
+        'n', 'rule', 'best', 'bound', '#nodes', 'time (s)', 'cb time (s)', 'cb mean (ms)', 'nodes/s'))
+    for n in sizes:
+        for rule in rules:
+            with contextlib.redirect_stdout(io.StringIO()):
+                mdl = build_lifegame_model(n)
+            mdl.parameters.mip.interval = 1
+            mdl.parameters.timelimit = time_limit
+            bcb = mdl.register_callback(MyBranch)
+            bcb.verbose = False
+            bcb.branching_rule = rule
+            stats = enable_stats(bcb, report_at_exit=False)
+            start = time.perf_counter()
+            s = mdl.solve()
+            elapsed = time.perf_counter() - start
+            summary = stats.summary()
+            nb_nodes = mdl.solve_details.nb_nodes_processed
+            print('| {:>3} | {:<21} | {:>6} | {:>6.1f} | {:>8} | {:>8.2f} | {:>10.2f} | {:>14.3f} | {:>8.0f} |'.format(
+                n, rule or 'loop', s.objective_value if s else '-', mdl.solve_details.best_bound, nb_nodes,
+                elapsed, summary['total_ms'] / 1000, summary['mean_ms'], nb_nodes / elapsed))
+            mdl.end()
+
+
+if __name__ == '__main__':
+    tlim = int(sys.argv[1]) if len(sys.argv) > 1 else 60
+    sizes = [int(a) for a in sys.argv[2:]] or (10, 12, 14)
+    bench_branching_rules(sizes, time_limit=tlim)
@@ -0,0 +1,132 @@
+# --------------------------------------------------------------------------
+# Source file provided under Apache License, Version 2.0, January 2004,
+# http://www.apache.org/licenses/
+# (c) Copyright IBM Corp. 2015, 2022
+# --------------------------------------------------------------------------
+
+"""
+Low-overhead statistics for callbacks of DOcplex models.
+
+Decorate the __call__() method of a callback with `timed_call`, then enable
+statistics on the registered callback instance with `enable_stats`:
+
+::
+
+    class MyCallback(ConstraintCallbackMixin, LazyConstraintCallback):
+
+        @timed_call(payload_counter='nb_lazy_cts')
+        def __call__(self):
+            ...
+
+    cb = mdl.register_callback(MyCallback)
+    enable_stats(cb)
+
+Each call then records its duration, and the change of the payload counter attribute
+(e.g. the number of constraints it added), into arrays allocated once. A summary with
+call count, total time, time percentiles and payload sizes is printed at exit.
+
+When statistics are not enabled, the decorated method only looks up one attribute
+before calling the original method; nothing is printed.
+Setting the DOCPLEX_CB_STATS environment variable to 1 enables statistics in the examples.
+"""
+
+import atexit
+import os
+import time
+from array import array
+
+
+def stats_enabled():
+    """ Returns True if the DOCPLEX_CB_STATS environment variable requests callback statistics. """
+    return os.environ.get('DOCPLEX_CB_STATS', '0') not in ('', '0')
+
+
+class CallbackStats(object):
+    """ Call statistics of one callback.
+
+    Durations and payloads of the last `capacity` calls are kept in preallocated
+    arrays, used as ring buffers; counts and totals cover all calls.
+    """
+
+    def __init__(self, name, capacity=65536):
+        self.name = name
+        self.capacity = capacity
+        self.nb_calls = 0
+        self.total_ns = 0
+        self.max_ns = 0
+        self.total_payload = 0
+        self._durations = array('q', bytes(8 * capacity))
+        self._payloads = array('q', bytes(8 * capacity))
+
+    def record(self, elapsed_ns, payload=0):
+        k = self.nb_calls % self.capacity
+        self._durations[k] = elapsed_ns
+        self._payloads[k] = payload
+        self.nb_calls += 1
+        self.total_ns += elapsed_ns
+        self.total_payload += payload
+        if elapsed_ns > self.max_ns:
+            self.max_ns = elapsed_ns
+
+    def summary(self, percentiles=(50, 90, 99)):
+        """ Returns a dictionary of statistics; times are in milliseconds.
+
+        Percentiles are computed on the last `capacity` calls.
+        """
+        nb_kept = min(self.nb_calls, self.capacity)
+        durations = sorted(self._durations[:nb_kept])
+        payloads = self._payloads[:nb_kept]
+        stats = {'name': self.name,
+                 'calls': self.nb_calls,
+                 'total_ms': self.total_ns / 1e6,
+                 'mean_ms': self.total_ns / 1e6 / self.nb_calls if self.nb_calls else 0,
+                 'max_ms': self.max_ns / 1e6,
+                 'total_payload': self.total_payload,
+                 'max_payload': max(payloads) if nb_kept else 0}
+        for p in percentiles:
+            stats['p{0}_ms'.format(p)] = durations[min(nb_kept - 1, (p * nb_kept) // 100)] / 1e6 if nb_kept else 0
+        return stats
+
+    def report(self):
+        s = self.summary()
+        print('* callback {name}: {calls} calls, total={total_ms:.3f} ms, mean={mean_ms:.4f} ms, '
+              'p50={p50_ms:.4f} ms, p90={p90_ms:.4f} ms, p99={p99_ms:.4f} ms, max={max_ms:.4f} ms, '
+              'payload total={total_payload}, max={max_payload}'.format(**s))
+
+
+def timed_call(payload_counter=None):
+    """ A decorator for __call__() methods of callbacks, recording statistics when enabled.
+
+    :param payload_counter: an optional name of an attribute of the callback, counting
+        items it produces (cuts, branches...); the increase during a call is its payload.
+    """
+    perf_counter_ns = time.perf_counter_ns
+
+    def cb_decorator(func):
+        def wrapper(self, *args, **kwargs):
+            stats = getattr(self, 'call_stats', None)
+            if stats is None:
+                return func(self, *args, **kwargs)
+            before = getattr(self, payload_counter) if payload_counter else 0
+            start = perf_counter_ns()
+            res = func(self, *args, **kwargs)
+            elapsed = perf_counter_ns() - start
+            stats.record(elapsed, getattr(self, payload_counter) - before if payload_counter else 0)
+            return res
+
+        wrapper.__name__ = func.__name__
+        wrapper.__doc__ = func.__doc__
+        return wrapper
+
+    return cb_decorator
+
+
+def enable_stats(cb, capacity=65536, report_at_exit=True):
+    """ Enables statistics on a callback instance, as returned by `Model.register_callback`.
+
+    :return: the `CallbackStats` instance.
+    """
+    cb.call_stats = CallbackStats(type(cb).__name__, capacity)
+    if report_at_exit:
+        atexit.register(cb.call_stats.report)
+    return cb.call_stats
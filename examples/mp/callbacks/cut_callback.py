@@ -22,6 +22,9 @@ from cplex.callbacks import UserCutCallback
 from docplex.mp.callbacks.cb_mixin import *
 from docplex.mp.model import Model
 
+from cb_stats import timed_call, enable_stats, stats_enabled
+from sparse_rows import SparseRowMatrix
+
 # Separate the disaggregated capacity constraints.
 # In the model we have for each location j the constraint
 #    sum(c in clients) supply[c][j] <= (nbClients-1) * used[j]
@@ -31,6 +34,10 @@ from docplex.mp.model import Model
 # that must be satisfied by every feasible solution. These constraints tend
 # to be violated in LP relaxation. In this callback we separate them in cuts
 # constraints added via a callback.
+# By default, all violated constraints are added at each call. When top_k is set,
+# violations are computed with array operations, ranked by violation divided by
+# the norm of the constraint, and only the k most violated are added; constraints
+# already added are skipped.
 
 
 class CustomCutCallback(ConstraintCallbackMixin, UserCutCallback):
@@ -40,12 +47,35 @@ class CustomCutCallback(ConstraintCallbackMixin, UserCutCallback):
         ConstraintCallbackMixin.__init__(self)
         self.eps = 1e-6
         self.nb_cuts = 0
+        # when set, only the top_k most violated cuts are added at each call
+        self.top_k = None
+        self.added_cuts = set()
+        self._cpx_cts = None
+        self._matrix = None
+        self._row_norms = None
 
     def add_cut_constraint(self, ct):
         self.register_constraint(ct)
 
+    def register_constraints(self, cts):
+        ConstraintCallbackMixin.register_constraints(self, cts)
+        self._matrix = None
+
+    def _get_or_compile_matrix(self):
+        import numpy as np
+        if self._matrix is None:
+            self._cpx_cts = [self.linear_ct_to_cplex(ct) for ct in self.cts]
+            self._matrix = SparseRowMatrix(self._cpx_cts)
+            self._row_norms = np.sqrt(np.bincount(self._matrix.rows, weights=self._matrix.data ** 2,
+                                                  minlength=self._matrix.nb_rows))
+        return self._matrix
+
+    @timed_call(payload_counter='nb_cuts')
     @print_called("--> custom cut callback called: #{0}")
     def __call__(self):
+        if self.top_k is not None:
+            self.add_top_violated_cuts(self.top_k)
+            return
         # fetch variable solution values at this point.
         sol = self.make_complete_solution()
         # fetch those constraints which are not satisfied.
@@ -56,8 +86,26 @@ class CustomCutCallback(ConstraintCallbackMixin, UserCutCallback):
             self.nb_cuts += 1
             print('-- add new cut[{0}]: [{1!s}]'.format(self.nb_cuts, ct))
 
-
-def build_supply_model(fixed_costs, supply_costs, use_cuts=False, **kwargs):
+    def add_top_violated_cuts(self, k):
+        # ranks violated cuts by violation divided by the norm of their coefficients,
+        # and adds the k first ones that were not added before.
+        import numpy as np
+        matrix = self._get_or_compile_matrix()
+        violated, violations = matrix.violated_rows(np.asarray(self.get_values()), self.eps, return_violations=True)
+        violations = violations[violated] / self._row_norms[violated]
+        is_new = np.array([r not in self.added_cuts for r in violated.tolist()], dtype=bool)
+        candidates, violations = violated[is_new], violations[is_new]
+        if len(candidates) > k:
+            best = np.argpartition(-violations, k - 1)[:k]
+            candidates = candidates[best[np.argsort(-violations[best])]]
+        for r in candidates.tolist():
+            self.add(*self._cpx_cts[r])
+            self.added_cuts.add(r)
+        self.nb_cuts += len(candidates)
+        print('-- added {0} of {1} violated cuts (total: {2})'.format(len(candidates), len(violated), self.nb_cuts))
+
+
+def build_supply_model(fixed_costs, supply_costs, use_cuts=False, top_k=None, **kwargs):
     m = Model(name='suppy', **kwargs)
 
     nb_locations = len(fixed_costs)
@@ -112,6 +160,9 @@ def build_supply_model(fixed_costs, supply_costs, use_cuts=False, **kwargs):
         # register a cut constraint callback
         # this links the model to the callback
         cut_cb = m.register_callback(CustomCutCallback)
+        cut_cb.top_k = top_k
+        if stats_enabled():
+            enable_stats(cut_cb)
 
         # store cut constraints inside the callback, as DOcplex objects
         # here we add the folwing cuts:
@@ -156,11 +207,14 @@ if __name__ == "__main__":
     # parse args
     args = sys.argv
     use_cuts = True
+    top_k = None
     for arg in args[1:]:
         if arg == '-cuts':
             use_cuts = False
         elif arg == '-nocuts':
             use_cuts = False
+        elif arg.startswith('-topk='):
+            top_k = int(arg[len('-topk='):])
         else:
             print('Unknown argument %s' % arg)
     random = False
@@ -175,7 +229,7 @@ if __name__ == "__main__":
         fixed = DEFAULT_FIXED_COSTS
         supply = DEFAULT_SUPPLY_COSTS
 
-    m = build_supply_model(fixed, supply, use_cuts=use_cuts)
+    m = build_supply_model(fixed, supply, use_cuts=use_cuts, top_k=top_k)
     m.parameters.preprocessing.presolve = 0
     m.print_information()
 
@@ -0,0 +1,66 @@
+"""
+Benchmarks for the cut callback example (cut_callback.py).
+
+Compares adding all violated cuts at each call with adding only the top-k most
+violated ones, on random facility location instances generated with fixed seeds.
+Every cut added is a new row of the LP, so the number of cuts is the LP growth.
+
+Usage: python cut_callback_benchmark.py [nb_locations nb_clients [k ...]]
+"""
+
+import contextlib
+import io
+import sys
+import time
+
+import numpy as np
+
+from cut_callback import build_supply_model
+
+
+def make_random_instance(nb_locations, nb_clients, seed=0):
+    rnd = np.random.RandomState(seed)
+    fixed = rnd.randint(100, high=500, size=nb_locations).tolist()
+    supply = rnd.randint(1, high=100, size=(nb_clients, nb_locations)).tolist()
+    return fixed, supply
+
+
+def bench_top_k(nb_locations=25, nb_clients=38, ks=(None, 5, 20, 50), seeds=(0, 1, 2)):
+    """ Solves each instance once per separation mode (None adds all violated cuts). """
+    print('* {} locations, {} clients'.format(nb_locations, nb_clients))
+    print('| {:>4} | {:>5} | {:>10} | {:>7} | {:>6} | {:>7} | {:>8} | {:>8} |'.format(
+        'seed', 'k', 'objective', '#calls', '#cuts', '#nodes', 'time (s)', 'nodes/s'))
+    for seed in seeds:
+        fixed, supply = make_random_instance(nb_locations, nb_clients, seed)
+        for k in ks:
+            # the callback prints one line per call or cut
+            out = io.StringIO()
+            with contextlib.redirect_stdout(out):
+                m = build_supply_model(fixed, supply, use_cuts=True, top_k=k)
+                params = m.parameters
+                params.preprocessing.presolve = 0
+                params.threads = 1
+                # as in build_supply_model comments: CPLEX cuts are turned off so that ours kick in
+                for cut_param in (params.mip.cuts.mircut, params.mip.cuts.implied, params.mip.cuts.gomory,
+                                  params.mip.cuts.flowcovers, params.mip.cuts.pathcut, params.mip.cuts.liftproj,
+                                  params.mip.cuts.zerohalfcut, params.mip.cuts.cliques, params.mip.cuts.covers):
+                    cut_param.set(-1)
+                cut_cb = m.cut_callback
+                start = time.perf_counter()
+                s = m.solve()
+                elapsed = time.perf_counter() - start
+            assert s
+            nb_calls = out.getvalue().count('custom cut callback called')
+            nb_nodes = m.solve_details.nb_nodes_processed
+            print('| {:>4} | {:>5} | {:>10.1f} | {:>7} | {:>6} | {:>7} | {:>8.2f} | {:>8.0f} |'.format(
+                seed, 'all' if k is None else k, s.objective_value, nb_calls, cut_cb.nb_cuts, nb_nodes,
+                elapsed, max(nb_nodes, 1) / elapsed))
+            m.end()
+
+
+if __name__ == '__main__':
+    if len(sys.argv) > 2:
+        ks = [None] + [int(a) for a in sys.argv[3:]] if len(sys.argv) > 3 else (None, 5, 20, 50)
+        bench_top_k(int(sys.argv[1]), int(sys.argv[2]), ks)
+    else:
+        bench_top_k()
@@ -12,34 +12,179 @@
 # You can run this example at the command line by
 #
 #    python heuristic_callback.py <filename>
+#
+# The file is read through the parsed-model cache of the workflow examples,
+# in ../workflow/model_cache.py.
 
+import importlib.util
+import os
 import sys
 
 from cplex.callbacks import HeuristicCallback
 
 from docplex.mp.callbacks.cb_mixin import *
 
+from cb_stats import timed_call, enable_stats, stats_enabled
+from sparse_rows import SparseRowMatrix
+
+
+class RoundingData(object):
+    """ Arrays describing a MIP model, compiled once for rounding heuristics.
+
+    Besides rows (as a `SparseRowMatrix`), bounds, integrality and objective, it stores
+    propagation steps derived from the structure of rows:
+
+    - partition rows: equalities sum(x) == 1 over binary variables, where exactly the
+      variable with the largest LP value is set to 1,
+    - repair rows: inequalities with a single integer variable whose increase satisfies
+      the row (e.g. x - y >= 0 for x); the variable is raised to the smallest such value,
+    - definitions: equalities with a single continuous variable once the other ones are
+      known (e.g. cost = fixed + transport); the variable is computed from the row.
+    """
+
+    def __init__(self, mdl, obj_coefs, eps=1e-6):
+        import numpy as np
+        self.eps = eps
+        nb_vars = mdl.number_of_variables
+        self.nb_vars = nb_vars
+        self.lb = np.zeros(nb_vars)
+        self.ub = np.zeros(nb_vars)
+        self.is_int = np.zeros(nb_vars, dtype=bool)
+        for dv in mdl.iter_variables():
+            self.lb[dv.index], self.ub[dv.index] = dv.lb, dv.ub
+            self.is_int[dv.index] = dv.is_integer() or dv.is_binary()
+        self.obj = np.asarray(obj_coefs, dtype=np.float64)
+        self.minimize = mdl.is_minimized()
+        self.matrix = SparseRowMatrix([ModelCallbackMixin.linear_ct_to_cplex(ct)
+                                       for ct in mdl.iter_linear_constraints()])
+
+        self.partition_rows = []
+        self.repair_rows = []
+        self.definitions = []
+        rows = []
+        for r in range(self.matrix.nb_rows):
+            begin, end = self.matrix.indptr[r], self.matrix.indptr[r + 1]
+            rows.append((self.matrix.indices[begin:end], self.matrix.data[begin:end]))
+        is_eq = ~(self.matrix.is_le | self.matrix.is_ge)
+        is_binary = self.is_int & (self.lb == 0) & (self.ub == 1)
+        for r, (cols, coefs) in enumerate(rows):
+            if is_eq[r]:
+                if self.matrix.rhs[r] == 1 and np.all(coefs == 1) and np.all(is_binary[cols]):
+                    self.partition_rows.append(cols)
+                continue
+            # the variable that can be raised to satisfy the row
+            helps = self.is_int[cols] & ((coefs < 0) if self.matrix.is_le[r] else (coefs > 0))
+            if np.count_nonzero(helps) == 1:
+                k = int(np.flatnonzero(helps)[0])
+                self.repair_rows.append((r, cols[k], coefs[k]))
+        # definitions, in an order where each one only uses known variables
+        known = self.is_int.copy()
+        eq_rows = [r for r in range(self.matrix.nb_rows) if is_eq[r]]
+        progress = True
+        while progress:
+            progress = False
+            for r in eq_rows:
+                cols, coefs = rows[r]
+                unknown = cols[~known[cols]]
+                if len(unknown) == 1:
+                    v = int(unknown[0])
+                    self.definitions.append((r, v, float(coefs[cols == v][0])))
+                    known[v] = True
+                    progress = True
+
+    def make_candidates(self, x, thresholds=(1.0, 0.5, 0.3, 0.7, 1e-6)):
+        """ Returns a candidates x variables matrix of rounded solutions, built from LP values x.
+
+        Integer variables are rounded up when their fractional part reaches a threshold
+        (1 rounds down, a small one rounds up); each rounding is used alone and followed
+        by the fix and propagate steps. Continuous variables are then computed from the
+        definitions, or keep their LP value.
+        """
+        import numpy as np
+        x = np.clip(x, self.lb, self.ub)
+        xi = x[self.is_int]
+        lo = np.floor(xi + self.eps)
+        frac = xi - lo
+        nb_rounding = len(thresholds)
+        candidates = np.tile(x, (2 * nb_rounding, 1))
+        for k, t in enumerate(thresholds):
+            candidates[k, self.is_int] = candidates[nb_rounding + k, self.is_int] = lo + (frac >= t)
+        fixed = candidates[nb_rounding:]
+        # fix: partition rows take the variable with the largest LP value
+        for cols in self.partition_rows:
+            fixed[:, cols] = 0
+            fixed[:, cols[np.argmax(x[cols])]] = 1
+        # propagate: raise repair variables as needed by their rows
+        for r, v, coef in self.repair_rows:
+            begin, end = self.matrix.indptr[r], self.matrix.indptr[r + 1]
+            others = fixed[:, self.matrix.indices[begin:end]] @ self.matrix.data[begin:end] - coef * fixed[:, v]
+            needed = np.ceil((self.matrix.rhs[r] - others) / coef - self.eps)
+            fixed[:, v] = np.minimum(np.maximum(fixed[:, v], needed), self.ub[v])
+        for r, v, coef in self.definitions:
+            begin, end = self.matrix.indptr[r], self.matrix.indptr[r + 1]
+            others = candidates[:, self.matrix.indices[begin:end]] @ self.matrix.data[begin:end] \
+                - coef * candidates[:, v]
+            candidates[:, v] = (self.matrix.rhs[r] - others) / coef
+        return candidates
+
+    def best_feasible(self, candidates, tolerance=1e-6):
+        """ Returns the index and objective value of the best feasible candidate, or (-1, None). """
+        import numpy as np
+        objectives = candidates @ self.obj
+        best, best_obj = -1, None
+        for k in np.argsort(objectives if self.minimize else -objectives):
+            xk = candidates[k]
+            if np.all(xk >= self.lb - tolerance) and np.all(xk <= self.ub + tolerance) and \
+                    not len(self.matrix.violated_rows(xk, tolerance)):
+                best, best_obj = int(k), float(objectives[k])
+                break
+        return best, best_obj
+
 
 class RoundDown(ModelCallbackMixin, HeuristicCallback):
+    # set to False to skip printing a line per solution found
+    verbose = True
+
     def __init__(self, env):
         HeuristicCallback.__init__(self, env)
         ModelCallbackMixin.__init__(self)
+        self.nb_rounded = 0
+        self.nb_solutions = 0
+        self._data = None
 
+    @timed_call(payload_counter='nb_rounded')
     @print_called('--> calling my_round_down callback... #{0}')
     def __call__(self):
-        feas = self.get_feasibilities()
-        var_indices = [j for j, f in enumerate(feas) if f == self.feasibility_status.feasible]
-        if var_indices:
+        import numpy as np
+        if self._data is None:
+            self._data = RoundingData(self.model, self.get_objective_coefficients())
+        data = self._data
+        x = np.fromiter(self.get_values(), dtype=np.float64, count=data.nb_vars)
+        candidates = data.make_candidates(x)
+        best, best_obj = data.best_feasible(candidates)
+        if best < 0:
+            return
+        if self.has_incumbent():
+            incumbent_obj = self.get_incumbent_objective_value()
+            if (best_obj >= incumbent_obj) if data.minimize else (best_obj <= incumbent_obj):
+                return
+        values = candidates[best]
+        self.nb_solutions += 1
+        self.nb_rounded += int(np.count_nonzero(values[data.is_int] != np.round(x[data.is_int])))
+        if self.verbose:
             # this shows how to get back to the DOcplex variable from the index
             # but is not necessary for the logic.
-            dvars = [self.index_to_var(v) for v in var_indices]
-            print('* rounded vars = [{0}]'.format(', '.join([v.name for v in dvars[:3]])))
-            # -- calling set-solution in cplex callback class
-            self.set_solution([var_indices, [0.0] * len(var_indices)])
+            dvars = [self.index_to_var(j) for j in np.flatnonzero(data.is_int & (values > 0.5))[:3]]
+            print('* rounded solution #{0}, objective={1:g}, from {2} candidates, vars set = [{3}]'
+                  .format(self.nb_solutions, best_obj, len(candidates), ', '.join(v.name for v in dvars)))
+        # -- calling set-solution in cplex callback class
+        self.set_solution([list(range(data.nb_vars)), values.tolist()], objective_value=best_obj)
 
 
 def try_heuristic_cb_on_model(mdl):
-    mdl.register_callback(RoundDown)
+    cb = mdl.register_callback(RoundDown)
+    if stats_enabled():
+        enable_stats(cb)
     # tweak cplex parameters
     mdl.parameters.mip.tolerances.mipgap = 1.0e-6
     mdl.parameters.mip.strategy.search = 0
@@ -51,9 +196,25 @@ def try_heuristic_cb_on_model(mdl):
     return s
 
 
-def try_heuristic_cb_on_file(filename):
-    from docplex.mp.model_reader import ModelReader
-    mdl = ModelReader.read(filename)
+def cached_read_model(filename, **kwargs):
+    # reads a model file with model_cache.read_model, loaded from the workflow directory
+    # (without adding it to sys.path); falls back to ModelReader.read if it is not there
+    module = sys.modules.get('model_cache')
+    if module is None:
+        path = os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir, 'workflow', 'model_cache.py')
+        if not os.path.exists(path):
+            from docplex.mp.model_reader import ModelReader
+            return ModelReader.read(filename, **kwargs)
+        spec = importlib.util.spec_from_file_location('model_cache', path)
+        module = importlib.util.module_from_spec(spec)
+        spec.loader.exec_module(module)
+        sys.modules['model_cache'] = module
+    return module.read_model(filename, **kwargs)
+
+
+def try_heuristic_cb_on_file(filename, read_model=cached_read_model):
+    # read_model reads the model file, default is through the parsed-model cache
+    mdl = read_model(filename)
     if mdl:
         return mdl, try_heuristic_cb_on_model(mdl)
 
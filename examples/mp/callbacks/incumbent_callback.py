@@ -13,6 +13,8 @@ import cplex._internal._constants as cpxcst
 from docplex.mp.callbacks.cb_mixin import *
 from docplex.mp.model import Model
 
+from cb_stats import timed_call, enable_stats, stats_enabled
+
 
 class CustomIncumbentCallback(ModelCallbackMixin, cpx_cb.IncumbentCallback):
 
@@ -29,6 +31,7 @@ class CustomIncumbentCallback(ModelCallbackMixin, cpx_cb.IncumbentCallback):
         ModelCallbackMixin.__init__(self)
         self.nb_incumbents = 0
 
+    @timed_call()
     def __call__(self):
         self.nb_incumbents += 1
         obj = self.get_objective_value()
@@ -76,7 +79,9 @@ def build_hearts(r, **kwargs):
 
 if __name__ == "__main__":
     love = build_hearts(r=11)
-    love.register_callback(CustomIncumbentCallback)
+    incumbent_cb = love.register_callback(CustomIncumbentCallback)
+    if stats_enabled():
+        enable_stats(incumbent_cb)
 
     love.parameters.mip.interval = 1
 
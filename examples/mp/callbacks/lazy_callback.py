@@ -19,30 +19,56 @@
 
 
 import sys
+import time
 
 from cplex.callbacks import LazyConstraintCallback
 
 from docplex.mp.callbacks.cb_mixin import *
 from docplex.mp.model import Model
 
+from cb_stats import timed_call, enable_stats, stats_enabled
+from sparse_rows import SparseRowMatrix
+
 
 # Lazy constraint callback to enforce the capacity constraints.
 # If used then the callback is invoked for every integer feasible solution
 # CPLEX finds. For each location j it checks whether constraint
 #    sum(c in C) supply[c][j] <= (|C| - 1) * used[j]
 # is satisfied. If not then it adds the violated constraint as lazy constraint.
+# With the 'csr' separation, registered constraints are compiled once into a sparse matrix,
+# and all of them are checked by one matrix-vector product on the values of variables.
 class CustomLazyCallback(ConstraintCallbackMixin, LazyConstraintCallback):
 
     def __init__(self, env):
         LazyConstraintCallback.__init__(self, env)
         ConstraintCallbackMixin.__init__(self)
         self.nb_lazy_cts = 0
+        self.separation = 'docplex'
+        self._cpx_cts = None
+        self._matrix = None
+        self.nb_calls = 0
+        self.separation_time = 0
 
     def add_lazy_constraints(self, cts):
         self.register_constraints(cts)
 
+    def register_constraints(self, cts):
+        ConstraintCallbackMixin.register_constraints(self, cts)
+        self._cpx_cts = None
+        self._matrix = None
+
+    def _get_or_compile_matrix(self):
+        if self._matrix is None:
+            self._cpx_cts = [self.linear_ct_to_cplex(ct) for ct in self.cts]
+            self._matrix = SparseRowMatrix(self._cpx_cts)
+        return self._matrix
+
+    @timed_call(payload_counter='nb_lazy_cts')
     @print_called('--> lazy constraint callback called: #{0}')
     def __call__(self):
+        if self.separation == 'csr':
+            self.separate_with_matrix()
+            return
         # fetch variable values into a solution
         sol = self.make_complete_solution()
         # for each lazy constraint, check whether it is verified,
@@ -52,8 +78,23 @@ class CustomLazyCallback(ConstraintCallbackMixin, LazyConstraintCallback):
             self.nb_lazy_cts += 1
             print('  -- new lazy constraint[{0}]: {1!s}'.format(self.nb_lazy_cts, ct))
 
-
-def build_supply_model(fixed_costs, supply_costs, lazy=True, **kwargs):
+    def separate_with_matrix(self, tolerance=1e-6):
+        import numpy as np
+        start = time.perf_counter()
+        matrix = self._get_or_compile_matrix()
+        violated = matrix.violated_rows(np.asarray(self.get_values()), tolerance)
+        for r in violated:
+            self.add(*self._cpx_cts[r])
+        elapsed = time.perf_counter() - start
+        self.nb_calls += 1
+        self.nb_lazy_cts += len(violated)
+        self.separation_time += elapsed
+        print('  -- lazy separation #{0}: {1} violated of {2} constraints, {3:.3f} ms (total: {4} constraints, {5:.3f} ms)'
+              .format(self.nb_calls, len(violated), matrix.nb_rows, 1000 * elapsed,
+                      self.nb_lazy_cts, 1000 * self.separation_time))
+
+
+def build_supply_model(fixed_costs, supply_costs, lazy=True, separation='docplex', **kwargs):
     m = Model(name='suppy', **kwargs)
 
     nb_locations = len(fixed_costs)
@@ -111,6 +152,9 @@ def build_supply_model(fixed_costs, supply_costs, lazy=True, **kwargs):
         # register a lazy constraint callback
         print('* add lazy constraints callback')
         lazyct_cb = m.register_callback(CustomLazyCallback)
+        lazyct_cb.separation = separation
+        if stats_enabled():
+            enable_stats(lazyct_cb)
 
         # store lazy constraints inside the callback, as DOcplex objects
         lazyct_cb.add_lazy_constraints(
@@ -152,11 +196,14 @@ if __name__ == "__main__":
     # parse args
     args = sys.argv
     use_lazy = True
+    separation = 'docplex'
     for arg in args[1:]:
         if arg == '-lazy':
             use_lazy = True
         if arg == '-nolazy':
             use_lazy = True
+        elif arg == '-csr':
+            separation = 'csr'
         else:
             print('Unknown argument %s' % arg)
     random = False
@@ -171,7 +218,7 @@ if __name__ == "__main__":
         fixed = DEFAULT_FIXED_COSTS
         supply = DEFAULT_SUPPLY_COSTS
 
-    m = build_supply_model(fixed, supply, lazy=use_lazy)
+    m = build_supply_model(fixed, supply, lazy=use_lazy, separation=separation)
     m.print_information()
 
     s = m.solve(log_output=True)
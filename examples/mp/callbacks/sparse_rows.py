@@ -0,0 +1,62 @@
+# --------------------------------------------------------------------------
+# Source file provided under Apache License, Version 2.0, January 2004,
+# http://www.apache.org/licenses/
+# (c) Copyright IBM Corp. 2015, 2022
+# --------------------------------------------------------------------------
+
+"""
+Linear constraints as a sparse matrix, for callbacks of DOcplex models.
+
+Callbacks that check many constraints at each call (lazy constraints, user cuts,
+rounding heuristics) compile them once into a `SparseRowMatrix`, then evaluate all
+rows on the values of variables with array operations:
+
+::
+
+    cpx_cts = [ModelCallbackMixin.linear_ct_to_cplex(ct) for ct in cts]
+    matrix = SparseRowMatrix(cpx_cts)
+    violated = matrix.violated_rows(np.array(self.get_values()))
+
+NumPy is imported when a matrix is built, so that importing this module does not require it.
+"""
+
+
+class SparseRowMatrix(object):
+    """ Linear constraints compiled into a sparse matrix in CSR format, for fast evaluation.
+
+    Rows are stored as (indptr, indices, data) arrays, with right-hand sides and senses
+    in the CPLEX convention ('L', 'G' or 'E'). Columns are CPLEX variable indices.
+    """
+
+    def __init__(self, cpx_cts):
+        import numpy as np
+        row_lengths = [len(lhs[0]) for lhs, _, _ in cpx_cts]
+        self.nb_rows = len(cpx_cts)
+        self.indptr = np.zeros(self.nb_rows + 1, dtype=np.int64)
+        np.cumsum(row_lengths, out=self.indptr[1:])
+        self.indices = np.fromiter((j for lhs, _, _ in cpx_cts for j in lhs[0]), dtype=np.int64,
+                                   count=self.indptr[-1])
+        self.data = np.fromiter((a for lhs, _, _ in cpx_cts for a in lhs[1]), dtype=np.float64,
+                                count=self.indptr[-1])
+        # row of each nonzero, to sum products by row
+        self.rows = np.repeat(np.arange(self.nb_rows), row_lengths)
+        self.rhs = np.array([rhs for _, _, rhs in cpx_cts], dtype=np.float64)
+        senses = np.array([sense for _, sense, _ in cpx_cts])
+        self.is_le = senses == 'L'
+        self.is_ge = senses == 'G'
+
+    def activities(self, values):
+        """ Returns the left-hand side value of all rows, for a vector of values of all variables. """
+        import numpy as np
+        return np.bincount(self.rows, weights=self.data * values[self.indices], minlength=self.nb_rows)
+
+    def violated_rows(self, values, tolerance=1e-6, return_violations=False):
+        """ Returns the indices of rows violated by more than tolerance.
+
+        If return_violations is True, also returns the violation of all rows (negative when satisfied).
+        """
+        import numpy as np
+        slack = self.activities(values) - self.rhs
+        violation = np.where(self.is_le, slack, np.where(self.is_ge, -slack, np.abs(slack)))
+        violated = np.flatnonzero(violation > tolerance)
+        return (violated, violation) if return_violations else violated
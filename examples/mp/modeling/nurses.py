@@ -4,7 +4,10 @@
 # (c) Copyright IBM Corp. 2015, 2018
 # --------------------------------------------------------------------------
 
-from collections import namedtuple
+from collections import namedtuple, defaultdict
+import heapq
+import json
+import time
 
 from docplex.mp.model import Model
 from docplex.util.environment import get_environment
@@ -28,6 +31,16 @@ def day_to_day_week(day):
     return day_map[day.lower()]
 
 
+def day_to_day_index(day):
+    """ Converts a day string to a number of days since the first Monday.
+
+    A day is a weekday name, optionally followed by a week number for rosters of
+    several weeks: "tuesday" or "tuesday_1" is in the first week, "tuesday_2" in the second.
+    """
+    weekday, _, week = day.partition('_')
+    return day_to_day_week(weekday) + 7 * (int(week) - 1 if week else 0)
+
+
 TWorkRules = namedtuple("TWorkRules", ["work_time_max"])
 TVacation = namedtuple("TVacation", ["nurse", "day"])
 TNursePair = namedtuple("TNursePair", ["firstNurse", "secondNurse"])
@@ -222,8 +235,9 @@ class TShift(namedtuple("TShift",
     def __str__(self):
         # keep first two characters in department, uppercase
         dept2 = self.department[0:4].upper()
-        # keep 3 days of weekday
-        dayname = self.day[0:3]
+        # keep 3 days of weekday, and the week number if any
+        weekday, _, week = self.day.partition('_')
+        dayname = weekday[0:3] + week
         return '{}_{}_{:02d}'.format(dept2, dayname, self.start_time).replace(" ", "_")
 
 
@@ -251,7 +265,7 @@ class ShiftActivity(object):
         self._start_time_of_day = start_time_of_day
         self._end_time_of_day = end_time_of_day
         # conversion to absolute time.
-        start_day_index = day_to_day_week(self._weekday)
+        start_day_index = day_to_day_index(self._weekday)
         self.start_time = self.to_abstime(start_day_index, start_time_of_day)
         end_day_index = start_day_index if end_time_of_day > start_time_of_day else start_day_index + 1
         self.end_time = self.to_abstime(end_day_index, end_time_of_day)
@@ -268,6 +282,52 @@ class ShiftActivity(object):
             return other_shift.end_time > self.start_time and other_shift.start_time < self.end_time
 
 
+def iter_overlapping_shifts(shifts, shift_activities):
+    """ Yields the pairs (s1, s2) of overlapping shifts, where s1 comes before s2 in shifts.
+
+    Pairs come in the same order as in a double loop over shifts, but only overlapping
+    pairs are enumerated: shifts are swept by start time, with a heap of the end times
+    of the shifts in progress.
+    """
+    order = sorted(range(len(shifts)), key=lambda i: shift_activities[shifts[i]].start_time)
+    in_progress = []
+    pairs = []
+    for i in order:
+        activity = shift_activities[shifts[i]]
+        # shifts which end before this one starts do not overlap any later shift
+        while in_progress and in_progress[0][0] <= activity.start_time:
+            heapq.heappop(in_progress)
+        pairs.extend((j, i) if j < i else (i, j) for _, j in in_progress)
+        heapq.heappush(in_progress, (activity.end_time, i))
+    pairs.sort()
+    for i1, i2 in pairs:
+        yield shifts[i1], shifts[i2]
+
+
+def iter_overlapping_shift_cliques(shifts, shift_activities):
+    """ Yields the maximal groups of pairwise overlapping shifts, as lists in the order of shifts.
+
+    Shifts are swept by start time: the shifts in progress form a maximal group when one of
+    them ends after the last start. Every pair of overlapping shifts is in at least one group;
+    groups of one shift are not yielded.
+    """
+    order = sorted(range(len(shifts)), key=lambda i: shift_activities[shifts[i]].start_time)
+    in_progress = []
+    has_new_start = False
+    for i in order:
+        activity = shift_activities[shifts[i]]
+        if in_progress and in_progress[0][0] <= activity.start_time:
+            if has_new_start and len(in_progress) > 1:
+                yield [shifts[j] for j in sorted(j for _, j in in_progress)]
+            has_new_start = False
+            while in_progress and in_progress[0][0] <= activity.start_time:
+                heapq.heappop(in_progress)
+        heapq.heappush(in_progress, (activity.end_time, i))
+        has_new_start = True
+    if has_new_start and len(in_progress) > 1:
+        yield [shifts[j] for j in sorted(j for _, j in in_progress)]
+
+
 def solve(model, **kwargs):
     # Here, we set the number of threads for CPLEX to 2 and set the time limit to 2mins.
     model.parameters.threads = 2
@@ -276,7 +336,9 @@ def solve(model, **kwargs):
     if sol is not None:
         print("solution for a cost of {}".format(model.objective_value))
         print_information(model)
-        print_solution(model)
+        # assignment values are read once, for printing and saving
+        model.assignments = get_assignment_values(model)
+        print_solution(model, model.assignments)
         return model.objective_value
     else:
         print("* model is infeasible")
@@ -284,16 +346,20 @@ def solve(model, **kwargs):
 
 
 def load_data(model, shifts_, nurses_, nurse_skills, vacations_=None,
-              nurse_associations_=None, nurse_imcompatibilities_=None, verbose=True):
+              nurse_associations_=None, nurse_imcompatibilities_=None, verbose=True, skill_requirements_=None,
+              worked_hours_=None):
     """ Usage: load_data(shifts, nurses, nurse_skills, vacations) """
     model.number_of_overlaps = 0
     model.work_rules = DEFAULT_WORK_RULES
     model.shifts = [TShift(*shift_row) for shift_row in shifts_]
     model.nurses = [TNurse(*nurse_row) for nurse_row in nurses_]
-    model.skill_requirements = SKILL_REQUIREMENTS
+    model.skill_requirements = [TSkillRequirement(*skr) for skr in skill_requirements_]\
+    if skill_requirements_ is not None else SKILL_REQUIREMENTS
     model.nurse_skills = nurse_skills
     # transactional data
     model.vacations = [TVacation(*vacation_row) for vacation_row in vacations_] if vacations_ else []
+    # hours already worked by nurses, by nurse name, counted in their work time
+    model.worked_hours = dict(worked_hours_) if worked_hours_ else {}
     model.nurse_associations = [TNursePair(*npr) for npr in nurse_associations_]\
     if nurse_associations_ else []
     model.nurse_incompatibilities = [TNursePair(*npr) for npr in nurse_imcompatibilities_]\
@@ -316,6 +382,19 @@ def setup_data(model):
     model.shift_activities = {s: ShiftActivity(s.day, s.start_time, s.end_time) for s in model.shifts}
     # map from nurse names to nurse tuples.
     model.nurses_by_id = {n.name: n for n in model.nurses}
+    # lists of shifts by department and by day, of nurses by skill, in the order of shifts and nurses
+    shifts_by_department = defaultdict(list)
+    shifts_by_day = defaultdict(list)
+    for s in model.shifts:
+        shifts_by_department[s.department].append(s)
+        shifts_by_day[s.day].append(s)
+    nurses_by_skill = defaultdict(list)
+    for n in model.nurses:
+        for skill in set(model.nurse_skills.get(n.name, ())):
+            nurses_by_skill[skill].append(n)
+    model.shifts_by_department = dict(shifts_by_department)
+    model.shifts_by_day = dict(shifts_by_day)
+    model.nurses_by_skill = dict(nurses_by_skill)
 
 
 def setup_variables(model):
@@ -333,7 +412,7 @@ def setup_variables(model):
     model.average_nurse_work_time = model.continuous_var(lb=0, name='AverageWorkTime')
 
 
-def setup_constraints(model):
+def setup_constraints(model, overlap_cliques=False):
     all_nurses = model.nurses
     all_shifts = model.shifts
     nurse_assigned = model.nurse_assignment_vars
@@ -349,9 +428,10 @@ def setup_constraints(model):
     # compute nurse work time , average and under, over
     for n in all_nurses:
         work_time_var = nurse_work_time[n]
-        model.add_constraint(
-            work_time_var == model.sum(nurse_assigned[n, s] * shift_activities[s].duration for s in all_shifts),
-            "work_time_{0!s}".format(n))
+        work_time = model.sum(nurse_assigned[n, s] * shift_activities[s].duration for s in all_shifts)
+        if n.name in model.worked_hours:
+            work_time += model.worked_hours[n.name]
+        model.add_constraint(work_time_var == work_time, "work_time_{0!s}".format(n))
 
         # relate over/under average worktime variables to the worktime variables
         # the trick here is that variables have zero lower bound
@@ -373,25 +453,27 @@ def setup_constraints(model):
     v = 0
     for vac_nurse_id, vac_day in model.vacations:
         vac_n = nurses_by_id[vac_nurse_id]
-        for shift in (s for s in all_shifts if s.day == vac_day):
+        for shift in model.shifts_by_day.get(vac_day, ()):
             v += 1
             model.add_constraint(nurse_assigned[vac_n, shift] == 0,
                                  "medium_vacations_{0!s}_{1!s}_{2!s}".format(vac_n, vac_day, shift))
     #print('#vacation cts: {0}'.format(v))
 
     # a nurse cannot be assigned overlapping shifts
-    # post only one constraint per couple(s1, s2)
-    number_of_overlaps = 0
-    nb_shifts = len(all_shifts)
-    for i1 in range(nb_shifts):
-        for i2 in range(i1 + 1, nb_shifts):
-            s1 = all_shifts[i1]
-            s2 = all_shifts[i2]
-            if shift_activities[s1].overlaps(shift_activities[s2]):
-                number_of_overlaps += 1
-                for n in all_nurses:
-                    model.add_constraint(nurse_assigned[n, s1] + nurse_assigned[n, s2] <= 1,
-                                         "high_overlapping_{0!s}_{1!s}_{2!s}".format(s1, s2, n))
+    if overlap_cliques:
+        # post one constraint per group of shifts which all overlap each other
+        for c, clique in enumerate(iter_overlapping_shift_cliques(all_shifts, shift_activities), start=1):
+            for n in all_nurses:
+                model.add_constraint(model.sum(nurse_assigned[n, s] for s in clique) <= 1,
+                                     "high_overlapping_clique_{0:d}_{1!s}".format(c, n))
+    else:
+        # post only one constraint per couple(s1, s2)
+        number_of_overlaps = 0
+        for s1, s2 in iter_overlapping_shifts(all_shifts, shift_activities):
+            number_of_overlaps += 1
+            for n in all_nurses:
+                model.add_constraint(nurse_assigned[n, s1] + nurse_assigned[n, s2] <= 1,
+                                     "high_overlapping_{0!s}_{1!s}_{2!s}".format(s1, s2, n))
     #print('# overlapping cts: {0}'.format(number_of_overlaps))
 
     for s in all_shifts:
@@ -406,11 +488,10 @@ def setup_constraints(model):
 
     for (dept, skill, required) in model.skill_requirements:
         if required > 0:
-            for dsh in (s for s in all_shifts if dept == s.department):
+            skilled_nurses = model.nurses_by_skill.get(skill, ())
+            for dsh in model.shifts_by_department.get(dept, ()):
                 model.add_constraint(model.sum(nurse_assigned[skilled_nurse, dsh] for skilled_nurse in
-                                               (n for n in all_nurses if
-                                                n.name in model.nurse_skills.keys() and skill in model.nurse_skills[
-                                                    n.name])) >= required,
+                                               skilled_nurses) >= required,
                                      "high_required_{0!s}_{1!s}_{2!s}_{3!s}".format(dept, skill, required, dsh))
 
     # nurse-nurse associations
@@ -477,44 +558,234 @@ def print_information(model):
     model.report_kpis()
 
 
-def print_solution(model):
+def get_assignment_values(model, solution=None):
+    """ Returns the values of all assignment variables, read at once from the solution.
+
+    :return: a NumPy array with one row per nurse and one column per shift,
+        in the order of model.nurses and model.shifts.
+    """
+    import numpy as np
+    sol = solution or model.solution
+    nurse_assigned = model.nurse_assignment_vars
+    values = sol.get_values([nurse_assigned[n, s] for n in model.nurses for s in model.shifts])
+    return np.array(values, dtype=float).reshape(len(model.nurses), len(model.shifts))
+
+
+def get_solution_aggregates(model, assignments):
+    """ Computes assigned nurses and costs by department, and hours by nurse, from the
+    assignment values returned by `get_assignment_values`.
+    """
+    import numpy as np
+    durations = np.array([model.shift_activities[s].duration for s in model.shifts], dtype=float)
+    pay_rates = np.array([n.pay_rate for n in model.nurses], dtype=float)
+    hours = assignments * durations
+    assigned_by_shift = assignments.sum(axis=0)
+    cost_by_shift = pay_rates @ hours
+    shift_index = {s: k for k, s in enumerate(model.shifts)}
+    assigned_by_department = {}
+    cost_by_department = {}
+    for d in model.departments:
+        dept_shifts = [shift_index[s] for s in model.shifts_by_department[d]]
+        assigned_by_department[d] = float(assigned_by_shift[dept_shifts].sum())
+        cost_by_department[d] = float(cost_by_shift[dept_shifts].sum())
+    return assigned_by_department, cost_by_department, hours.sum(axis=1)
+
+
+def print_solution(model, assignments=None):
+    if assignments is None:
+        assignments = get_assignment_values(model)
+    assigned_by_department, cost_by_department, hours_by_nurse = get_solution_aggregates(model, assignments)
+    # totals with no assignment print as 0, as sums of zero solution values do
     print("*************************** Solution ***************************")
     print("Allocation By Department:")
     for d in model.departments:
-        print("\t{}: {}".format(d, sum(
-            model.nurse_assignment_vars[n, s].solution_value for n in model.nurses for s in model.shifts if
-            s.department == d)))
+        print("\t{}: {}".format(d, assigned_by_department[d] or 0))
     print("Cost By Department:")
     for d in model.departments:
-        cost = sum(
-            model.nurse_assignment_vars[n, s].solution_value * n.pay_rate * model.shift_activities[s].duration for n in
-            model.nurses for s in model.shifts if s.department == d)
-        print("\t{}: {}".format(d, cost))
+        print("\t{}: {}".format(d, cost_by_department[d] or 0))
     print("Nurses Assignments")
+    nurse_index = {n: i for i, n in enumerate(model.nurses)}
     for n in sorted(model.nurses):
-        total_hours = sum(
-            model.nurse_assignment_vars[n, s].solution_value * model.shift_activities[s].duration for s in model.shifts)
-        print("\t{}: total hours:{}".format(n.name, total_hours))
-        for s in model.shifts:
-            if model.nurse_assignment_vars[n, s].solution_value == 1:
-                print("\t\t{}: {} {}-{}".format(s.day, s.department, s.start_time, s.end_time))
+        i = nurse_index[n]
+        print("\t{}: total hours:{}".format(n.name, float(hours_by_nurse[i]) or 0))
+        for k in (assignments[i] == 1).nonzero()[0]:
+            s = model.shifts[k]
+            print("\t\t{}: {} {}-{}".format(s.day, s.department, s.start_time, s.end_time))
+
+
+def save_assignments_as_json(model, json_file, assignments=None):
+    """ Writes department totals and the shifts of each nurse, in JSON, to a binary stream. """
+    if assignments is None:
+        assignments = get_assignment_values(model)
+    assigned_by_department, cost_by_department, hours_by_nurse = get_solution_aggregates(model, assignments)
+    solution_dict = {"allocation by department": assigned_by_department,
+                     "cost by department": cost_by_department}
+    nurse_assignments = []
+    for i, n in enumerate(model.nurses):
+        nurse_assignments.append({"nurse": n.name,
+                                  "total hours": float(hours_by_nurse[i]),
+                                  "shifts": [str(model.shifts[k]) for k in (assignments[i] == 1).nonzero()[0]]})
+    solution_dict["nurse assignments"] = nurse_assignments
+    json_file.write(json.dumps(solution_dict, indent=3).encode('utf-8'))
 
 
 # ----------------------------------------------------------------------------
 # Build the model
 # ----------------------------------------------------------------------------
 
-def build(context=None, verbose=False, **kwargs):
+def build(context=None, verbose=False, overlap_cliques=False, **kwargs):
     mdl = Model("Nurses", context=context, **kwargs)
     load_data(mdl, SHIFTS, NURSES, NURSE_SKILLS, VACATIONS, NURSE_ASSOCIATIONS,
               NURSE_INCOMPATIBILITIES, verbose=verbose)
     setup_data(mdl)
     setup_variables(mdl)
-    setup_constraints(mdl)
+    setup_constraints(mdl, overlap_cliques=overlap_cliques)
     setup_objective(mdl)
     return mdl
 
 
+def build_from_data(shifts, nurses, nurse_skills, vacations=None, nurse_associations=None,
+                    nurse_incompatibilities=None, skill_requirements=None, worked_hours=None,
+                    work_time_max=None, context=None, overlap_cliques=False, **kwargs):
+    """ Builds the model for data in the format of the example data, e.g. over several weeks.
+
+    :param worked_hours: an optional dictionary of hours already worked, by nurse name.
+    :param work_time_max: the maximum work time of a nurse (default is that of DEFAULT_WORK_RULES).
+    """
+    mdl = Model("Nurses", context=context, **kwargs)
+    load_data(mdl, shifts, nurses, nurse_skills, vacations, nurse_associations, nurse_incompatibilities,
+              verbose=False, skill_requirements_=skill_requirements, worked_hours_=worked_hours)
+    if work_time_max is not None:
+        mdl.work_rules = TWorkRules(work_time_max)
+    setup_data(mdl)
+    setup_variables(mdl)
+    setup_constraints(mdl, overlap_cliques=overlap_cliques)
+    setup_objective(mdl)
+    return mdl
+
+
+# ----------------------------------------------------------------------------
+# Solve long horizons by windows
+# ----------------------------------------------------------------------------
+
+def solve_rolling_horizon(shifts, nurses, nurse_skills, vacations=None, nurse_associations=None,
+                          nurse_incompatibilities=None, skill_requirements=None, window_days=14, commit_days=7,
+                          weekly_work_time_max=DEFAULT_WORK_RULES.work_time_max, overlap_cliques=True,
+                          time_limit=None, verbose=False):
+    """ Assigns nurses to the shifts of a long horizon, solving one model per window of days.
+
+    Each window of window_days days is solved, then the assignments of its first commit_days
+    days are committed, and the next window starts after them. The model of a window has:
+     - the shifts of the last committed day, with fixed assignments, so that overlaps with them are forbidden,
+     - the hours worked in earlier committed shifts, counted in the work time of nurses,
+     - a MIP start with the assignments found by the previous window on the days both share.
+
+    The maximum work time of a nurse over the horizon is weekly_work_time_max, prorated to the
+    number of days of the horizon, as in the model of the whole horizon.
+
+    Committed windows may use up work time which later windows need. When a window has no
+    solution, the commit of the previous window is undone, and the previous window is solved
+    again up to the end of the failed one, then committed as a whole. Windows are merged back
+    this way until one has a solution; when the window from the first day has none, there is
+    no solution on these days, hence none on the whole horizon.
+
+    :return: a tuple (assignments, window_stats), where assignments is the list of committed
+        (nurse name, shift) pairs, and window_stats a list of dictionaries, one per committed window;
+        None if there is no solution.
+    """
+    assert 0 < commit_days <= window_days
+    shift_days = {TShift(*row): day_to_day_index(row[1]) for row in shifts}
+    nb_days = max(shift_days.values()) + 1
+    work_time_max = weekly_work_time_max * nb_days / 7.0
+    assignments = []
+    worked_hours = defaultdict(float)
+    last_day_assigned = {}
+    last_day_hours = defaultdict(float)
+    previous_values = {}
+    window_stats = []
+    # the state before each committed window, to undo its commit
+    committed_states = []
+    # the end of the last window with no solution, when solving it merged with the previous one
+    merged_end = 0
+    start = 0
+    while start < nb_days:
+        end = min(max(start + window_days, merged_end), nb_days)
+        commit_end = end if end == nb_days or merged_end else start + commit_days
+        state = (start, len(assignments), worked_hours.copy(), last_day_assigned, last_day_hours,
+                 previous_values, len(window_stats))
+        window_shifts = [s for s, d in shift_days.items() if start - 1 <= d < end]
+        window_vacations = [v for v in vacations or () if start <= day_to_day_index(v[1]) < end]
+        # hours of the last committed day are those of fixed shifts in the window
+        carried_hours = {name: hours - last_day_hours[name] for name, hours in worked_hours.items()}
+        mdl = build_from_data(window_shifts, nurses, nurse_skills, window_vacations, nurse_associations,
+                              nurse_incompatibilities, skill_requirements, carried_hours,
+                              work_time_max=work_time_max, overlap_cliques=overlap_cliques)
+        nurse_assigned = mdl.nurse_assignment_vars
+        start_values = {}
+        for n in mdl.nurses:
+            for s in mdl.shifts:
+                if s in last_day_assigned:
+                    value = 1 if n.name in last_day_assigned[s] else 0
+                    nurse_assigned[n, s].lb = value
+                    nurse_assigned[n, s].ub = value
+                    start_values[nurse_assigned[n, s]] = value
+                elif (n.name, s) in previous_values:
+                    start_values[nurse_assigned[n, s]] = previous_values[n.name, s]
+        if start_values:
+            mdl.add_mip_start(mdl.new_solution(var_value_dict=start_values))
+        if time_limit is not None:
+            mdl.parameters.timelimit = time_limit
+
+        solve_start = time.perf_counter()
+        sol = mdl.solve()
+        solve_time = time.perf_counter() - solve_start
+        if not sol:
+            status = mdl.solve_details.status
+            mdl.end()
+            if not committed_states:
+                print("* window of days {0}-{1} has no solution: {2}".format(start, end - 1, status))
+                return None
+            failed_start = start
+            (start, nb_assignments, worked_hours, last_day_assigned, last_day_hours,
+             previous_values, nb_windows) = committed_states.pop()
+            del assignments[nb_assignments:]
+            del window_stats[nb_windows:]
+            merged_end = end
+            if verbose:
+                print("* window of days {0}-{1} has no solution: {2}, solving days {3}-{1}".format(
+                    failed_start, end - 1, status, start))
+            continue
+        committed_states.append(state)
+        merged_end = 0
+        window_stats.append({'start': start, 'end': end, 'shifts': len(mdl.shifts),
+                             'mip_start': len(start_values), 'objective': sol.objective_value,
+                             'time': solve_time})
+        if verbose:
+            print("* days {0}-{1}: {2} shifts, objective={3:g}, time={4:.2f} s".format(
+                start, end - 1, len(mdl.shifts), sol.objective_value, solve_time))
+
+        values = get_assignment_values(mdl, sol)
+        last_day_assigned = {s: set() for s in mdl.shifts if shift_days[s] == commit_end - 1}
+        last_day_hours = defaultdict(float)
+        previous_values = {}
+        for i, n in enumerate(mdl.nurses):
+            for k, s in enumerate(mdl.shifts):
+                d = shift_days[s]
+                assigned = values[i, k] > 0.5
+                if start <= d < commit_end:
+                    if assigned:
+                        assignments.append((n.name, s))
+                        worked_hours[n.name] += mdl.shift_activities[s].duration
+                        if d == commit_end - 1:
+                            last_day_assigned[s].add(n.name)
+                            last_day_hours[n.name] += mdl.shift_activities[s].duration
+                elif d >= commit_end:
+                    previous_values[n.name, s] = 1 if assigned else 0
+        mdl.end()
+        start = commit_end
+    return assignments, window_stats
+
+
 # ----------------------------------------------------------------------------
 # Solve the model and display the result
 # ----------------------------------------------------------------------------
@@ -529,4 +800,7 @@ if __name__ == '__main__':
     # Save the CPLEX solution as "solution.json" program output
     with get_environment().get_output_stream("solution.json") as fp:
         model.solution.export(fp, "json")
+    # and the nurse assignments as "assignments.json"
+    with get_environment().get_output_stream("assignments.json") as fp:
+        save_assignments_as_json(model, fp, model.assignments)
     model.end()
@@ -0,0 +1,286 @@
+"""
+Benchmarks for the nurses example (nurses.py), on rosters generated by
+`make_random_roster` with a fixed seed: several departments, over several weeks.
+
+Usage:
+    python nurses_benchmark.py overlaps [nb_departments [nb_weeks]]
+    python nurses_benchmark.py cliques [nb_departments [nb_weeks [nb_nurses]]]
+    python nurses_benchmark.py indexes [nb_departments [nb_weeks [nb_nurses]]]
+    python nurses_benchmark.py rolling [nb_departments [nb_weeks [nb_nurses [window_days [commit_days]]]]]
+"""
+
+import random
+import sys
+import time
+
+from docplex.mp.model import Model
+from docplex.mp.utils import DOcplexLimitsExceeded
+
+from nurses import TShift, ShiftActivity, iter_overlapping_shifts, _all_days, DEFAULT_WORK_RULES, \
+    load_data, setup_data, setup_variables, setup_constraints, setup_objective, build_from_data, \
+    solve_rolling_horizon
+
+# (start, end) hours of the shifts a department may open on a day, as in SHIFTS;
+# start hours differ, since shift names are made of department, day and start hour
+SHIFT_PATTERNS = [(2, 8), (8, 12), (12, 18), (18, 2), (6, 14), (14, 22), (22, 6)]
+
+
+def make_random_roster(nb_departments=30, nb_weeks=4, nb_nurses=100, seed=0):
+    """ Generates shifts, nurses, nurse skills, skill requirements and vacations, in the format
+    of SHIFTS, NURSES, NURSE_SKILLS, SKILL_REQUIREMENTS and VACATIONS.
+
+    Days after the first week carry their week number, e.g. "tuesday_2". Each department
+    requires a nurse with the skill of the same name on each of its shifts.
+    """
+    rnd = random.Random(seed)
+    # the first four characters of department names are kept in shift names
+    departments = ['D{0:03d}'.format(d) for d in range(nb_departments)]
+    days = [day if w == 0 else '{0}_{1}'.format(day, w + 1) for w in range(nb_weeks) for day in _all_days]
+    shifts = []
+    for dept in departments:
+        for day in days:
+            for start, end in sorted(rnd.sample(SHIFT_PATTERNS, rnd.randint(2, 5))):
+                min_req = rnd.randint(1, 2)
+                shifts.append((dept, day, start, end, min_req, min_req + rnd.randint(1, 4)))
+    nurses = [('Nurse_{0:04d}'.format(n), rnd.randint(1, 11), rnd.randint(1, 5), rnd.randint(15, 40))
+              for n in range(nb_nurses)]
+    nurse_skills = {name: rnd.sample(departments, min(nb_departments, 3)) for name, _, _, _ in nurses}
+    skill_requirements = [(dept, dept, 1) for dept in departments]
+    vacations = [(name, day) for name, _, _, _ in nurses for day in rnd.sample(days, nb_weeks)]
+    return shifts, nurses, nurse_skills, skill_requirements, vacations
+
+
+def pairwise_overlapping_shifts(shifts, shift_activities):
+    # the double loop formerly used in setup_constraints
+    nb_shifts = len(shifts)
+    for i1 in range(nb_shifts):
+        for i2 in range(i1 + 1, nb_shifts):
+            s1 = shifts[i1]
+            s2 = shifts[i2]
+            if shift_activities[s1].overlaps(shift_activities[s2]):
+                yield s1, s2
+
+
+def bench_overlaps(nb_departments=30, nb_weeks=4, seed=0):
+    """ Compares the pairwise loop and the sweep over start times, enumerating overlapping shifts. """
+    shifts = [TShift(*row) for row in make_random_roster(nb_departments, nb_weeks, seed=seed)[0]]
+    shift_activities = {s: ShiftActivity(s.day, s.start_time, s.end_time) for s in shifts}
+    print('* {} departments, {} weeks, {} shifts'.format(nb_departments, nb_weeks, len(shifts)))
+    print('| {:<9} | {:>10} | {:>9} | {:>8} |'.format('method', '#overlaps', 'time (s)', 'speedup'))
+    results = []
+    for method, enumerate_fn in (('pairwise', pairwise_overlapping_shifts), ('sweep', iter_overlapping_shifts)):
+        start = time.perf_counter()
+        pairs = list(enumerate_fn(shifts, shift_activities))
+        results.append((method, pairs, time.perf_counter() - start))
+    for method, pairs, elapsed in results:
+        print('| {:<9} | {:>10} | {:>9.3f} | {:>8.1f} |'.format(method, len(pairs), elapsed, results[0][2] / elapsed))
+    # same pairs, in the same order, hence the same constraints
+    assert results[0][1] == results[1][1]
+
+
+def build_roster_model(shifts, nurses, nurse_skills, skill_requirements=None, vacations=None,
+                       overlap_cliques=False, **kwargs):
+    """ Builds the nurses model for generated data, as `nurses.build` does for the example data. """
+    mdl = Model("Nurses", **kwargs)
+    load_data(mdl, shifts, nurses, nurse_skills, vacations, verbose=False, skill_requirements_=skill_requirements)
+    setup_data(mdl)
+    setup_variables(mdl)
+    setup_constraints(mdl, overlap_cliques=overlap_cliques)
+    setup_objective(mdl)
+    return mdl
+
+
+def bench_cliques(nb_departments=10, nb_weeks=1, nb_nurses=40, seed=0, time_limit=60):
+    """ Compares one no-overlap constraint per pair of overlapping shifts with one per maximal group.
+
+    Models too large for the installed CPLEX are built but not solved.
+    """
+    roster = make_random_roster(nb_departments, nb_weeks, nb_nurses, seed)
+    print('* {} departments, {} weeks, {} shifts, {} nurses'.format(nb_departments, nb_weeks, len(roster[0]),
+                                                                    nb_nurses))
+    print('| {:<9} | {:>9} | {:>9} | {:>14} | {:>14} | {:>12} |'.format(
+        'mode', '#rows', '#nonzeros', 'build time (s)', 'solve time (s)', 'objective'))
+    for overlap_cliques in (False, True):
+        start = time.perf_counter()
+        mdl = build_roster_model(*roster, overlap_cliques=overlap_cliques)
+        build_time = time.perf_counter() - start
+        nb_nonzeros = sum(ct.size for ct in mdl.iter_constraints())
+        mdl.parameters.timelimit = time_limit
+        try:
+            s = mdl.solve()
+            solve_time = '{:.2f}'.format(mdl.solve_details.time)
+            objective = '{:.1f}'.format(s.objective_value) if s else mdl.solve_details.status
+        except DOcplexLimitsExceeded:
+            solve_time = objective = '-'
+        print('| {:<9} | {:>9} | {:>9} | {:>14.2f} | {:>14} | {:>12} |'.format(
+            'cliques' if overlap_cliques else 'pairs', mdl.number_of_constraints, nb_nonzeros, build_time,
+            solve_time, objective))
+        mdl.end()
+
+
+class ScanIndex(object):
+    """ Looks up shifts or nurses by scanning them all, as setup_constraints did before indexes;
+    replaces an index built by `nurses.setup_data` in a model.
+    """
+
+    def __init__(self, items, matches):
+        self._items = items
+        self._matches = matches
+
+    def get(self, key, default=None):
+        return [x for x in self._items if self._matches(x, key)]
+
+
+def bench_indexes(nb_departments=30, nb_weeks=2, nb_nurses=100, seed=0):
+    """ Compares scans of all shifts and nurses with the indexes built by `nurses.setup_data`,
+    for the lookups made by the skill and vacation constraints and by `print_solution`,
+    then in the build of the whole model.
+    """
+    roster = make_random_roster(nb_departments, nb_weeks, nb_nurses, seed)
+    mdl = Model("Nurses")
+    load_data(mdl, roster[0], roster[1], roster[2], roster[4], verbose=False, skill_requirements_=roster[3])
+    all_shifts = mdl.shifts
+    all_nurses = mdl.nurses
+    print('* {} departments, {} weeks, {} shifts, {} nurses'.format(nb_departments, nb_weeks, len(all_shifts),
+                                                                    len(all_nurses)))
+
+    def scan_lookups():
+        # as setup_constraints and print_solution did before indexes
+        skilled = [[[n for n in all_nurses if n.name in mdl.nurse_skills.keys() and skill in mdl.nurse_skills[n.name]]
+                    for dsh in (s for s in all_shifts if dept == s.department)]
+                   for dept, skill, _ in mdl.skill_requirements]
+        vacation_shifts = [[s for s in all_shifts if s.day == vac_day] for _, vac_day in mdl.vacations]
+        report_shifts = [[s for n in all_nurses for s in all_shifts if s.department == d] for d in mdl.departments]
+        return skilled, vacation_shifts, report_shifts
+
+    def index_lookups():
+        setup_data(mdl)
+        skilled = [[list(mdl.nurses_by_skill.get(skill, ())) for _ in mdl.shifts_by_department.get(dept, ())]
+                   for dept, skill, _ in mdl.skill_requirements]
+        vacation_shifts = [list(mdl.shifts_by_day.get(vac_day, ())) for _, vac_day in mdl.vacations]
+        report_shifts = [[s for n in all_nurses for s in mdl.shifts_by_department[d]] for d in mdl.departments]
+        return skilled, vacation_shifts, report_shifts
+
+    print('| {:<7} | {:>9} | {:>8} |'.format('lookups', 'time (s)', 'speedup'))
+    results = []
+    for method, lookup_fn in (('scan', scan_lookups), ('index', index_lookups)):
+        start = time.perf_counter()
+        lookups = lookup_fn()
+        results.append((method, lookups, time.perf_counter() - start))
+    for method, _, elapsed in results:
+        print('| {:<7} | {:>9.3f} | {:>8.1f} |'.format(method, elapsed, results[0][2] / elapsed))
+    # same nurses and shifts, in the same order, hence the same constraints
+    assert results[0][1] == results[1][1]
+    mdl.end()
+
+    def build_timed(scans):
+        # the phases of nurses.build, with the indexes replaced by scans if required
+        times = []
+        start = time.perf_counter()
+        model = Model("Nurses")
+        load_data(model, roster[0], roster[1], roster[2], roster[4], verbose=False, skill_requirements_=roster[3])
+        setup_data(model)
+        if scans:
+            model.shifts_by_department = ScanIndex(model.shifts, lambda s, dept: s.department == dept)
+            model.shifts_by_day = ScanIndex(model.shifts, lambda s, day: s.day == day)
+            model.nurses_by_skill = ScanIndex(model.nurses,
+                                              lambda n, skill: skill in model.nurse_skills.get(n.name, ()))
+        times.append(time.perf_counter() - start)
+        setup_variables(model)
+        times.append(time.perf_counter() - start - sum(times))
+        # with cliques, no-overlap constraints, which use no index, do not outweigh the others
+        setup_constraints(model, overlap_cliques=True)
+        times.append(time.perf_counter() - start - sum(times))
+        setup_objective(model)
+        times.append(time.perf_counter() - start)
+        return model, times
+
+    print('| {:<7} | {:>8} | {:>13} | {:>15} | {:>14} | {:>8} |'.format(
+        'build', 'data (s)', 'variables (s)', 'constraints (s)', 'total time (s)', 'speedup'))
+    results = []
+    for method, scans in (('scan', True), ('index', False)):
+        model, times = build_timed(scans)
+        results.append((method, [ct.name for ct in model.iter_constraints()], times))
+        model.end()
+    for method, _, times in results:
+        print('| {:<7} | {:>8.3f} | {:>13.3f} | {:>15.3f} | {:>14.3f} | {:>8.1f} |'.format(
+            method, times[0], times[1], times[2], times[3], results[0][2][3] / times[3]))
+    # the same constraints, in the same order
+    assert results[0][1] == results[1][1]
+
+
+def _solve_objective(mdl):
+    # the objective value, or None with the reason why there is none
+    try:
+        s = mdl.solve()
+    except DOcplexLimitsExceeded:
+        return None, 'too large'
+    return (s.objective_value, None) if s else (None, 'no solution')
+
+
+def bench_rolling_horizon(nb_departments=1, nb_weeks=3, nb_nurses=8, window_days=10, commit_days=5, seed=0,
+                          time_limit=60):
+    """ Compares the solve of a whole horizon with the rolling horizon driver.
+
+    The objective of the rolling horizon schedule is evaluated in the model of the whole
+    horizon, with all assignments fixed.
+    """
+    shifts, nurses, nurse_skills, skill_requirements, vacations = \
+        make_random_roster(nb_departments, nb_weeks, nb_nurses, seed)
+    work_time_max = DEFAULT_WORK_RULES.work_time_max * nb_weeks
+
+    def build_horizon_model():
+        return build_from_data(shifts, nurses, nurse_skills, vacations, skill_requirements=skill_requirements,
+                               work_time_max=work_time_max, overlap_cliques=True)
+
+    print('* {} departments, {} weeks, {} shifts, {} nurses, windows of {} days, {} committed'.format(
+        nb_departments, nb_weeks, len(shifts), nb_nurses, window_days, commit_days))
+    print('| {:<9} | {:>8} | {:>12} | {:>9} | {:>8} |'.format('method', '#windows', 'objective', 'time (s)', 'gap (%)'))
+    mdl = build_horizon_model()
+    mdl.parameters.timelimit = time_limit
+    start = time.perf_counter()
+    full_objective, reason = _solve_objective(mdl)
+    full_time = time.perf_counter() - start
+    mdl.end()
+    print('| {:<9} | {:>8} | {:>12} | {:>9.2f} | {:>8} |'.format(
+        'monolith', 1, reason or '{:.1f}'.format(full_objective), full_time, '-'))
+
+    start = time.perf_counter()
+    try:
+        res = solve_rolling_horizon(shifts, nurses, nurse_skills, vacations, skill_requirements=skill_requirements,
+                                    window_days=window_days, commit_days=commit_days, time_limit=time_limit)
+        reason = 'no solution'
+    except DOcplexLimitsExceeded:
+        res, reason = None, 'too large'
+    rolling_time = time.perf_counter() - start
+    if res is None:
+        print('| {:<9} | {:>8} | {:>12} | {:>9.2f} | {:>8} |'.format('rolling', '-', reason, rolling_time, '-'))
+        return
+    assignments, window_stats = res
+    mdl = build_horizon_model()
+    assigned = set(assignments)
+    for (n, s), dv in mdl.nurse_assignment_vars.items():
+        dv.lb = dv.ub = 1 if (n.name, s) in assigned else 0
+    rolling_objective, reason = _solve_objective(mdl)
+    mdl.end()
+    gap = '-'
+    if full_objective and rolling_objective is not None:
+        gap = '{:.2f}'.format(100 * (rolling_objective - full_objective) / abs(full_objective))
+    print('| {:<9} | {:>8} | {:>12} | {:>9.2f} | {:>8} |'.format(
+        'rolling', len(window_stats), reason or '{:.1f}'.format(rolling_objective), rolling_time, gap))
+
+
+if __name__ == '__main__':
+    bench = sys.argv[1] if len(sys.argv) > 1 else 'overlaps'
+    args = [int(a) for a in sys.argv[2:]]
+    if bench == 'overlaps':
+        bench_overlaps(*args)
+    elif bench == 'cliques':
+        bench_cliques(*args)
+    elif bench == 'indexes':
+        bench_indexes(*args)
+    elif bench == 'rolling':
+        bench_rolling_horizon(*args)
+    else:
+        print('Usage: {} overlaps|cliques|indexes|rolling [nb_departments [nb_weeks [nb_nurses]]]'.format(
+            sys.argv[0]))
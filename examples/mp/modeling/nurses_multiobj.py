@@ -4,12 +4,15 @@
 # (c) Copyright IBM Corp. 2015, 2018
 # --------------------------------------------------------------------------
 
-from collections import namedtuple
+from collections import namedtuple, defaultdict
 
 from docplex.mp.model import Model
 from docplex.mp.constants import ObjectiveSense
 from docplex.util.environment import get_environment
 
+from nurses import day_to_day_index, iter_overlapping_shifts, iter_overlapping_shift_cliques, \
+    get_assignment_values, print_solution, save_assignments_as_json
+
 # ----------------------------------------------------------------------------
 # Initialize the problem data
 # ----------------------------------------------------------------------------
@@ -223,8 +226,9 @@ class TShift(namedtuple("TShift",
     def __str__(self):
         # keep first two characters in department, uppercase
         dept2 = self.department[0:4].upper()
-        # keep 3 days of weekday
-        dayname = self.day[0:3]
+        # keep 3 days of weekday, and the week number if any
+        weekday, _, week = self.day.partition('_')
+        dayname = weekday[0:3] + week
         return '{}_{}_{:02d}'.format(dept2, dayname, self.start_time).replace(" ", "_")
 
 
@@ -252,7 +256,7 @@ class ShiftActivity(object):
         self._start_time_of_day = start_time_of_day
         self._end_time_of_day = end_time_of_day
         # conversion to absolute time.
-        start_day_index = day_to_day_week(self._weekday)
+        start_day_index = day_to_day_index(self._weekday)
         self.start_time = self.to_abstime(start_day_index, start_time_of_day)
         end_day_index = start_day_index if end_time_of_day > start_time_of_day else start_day_index + 1
         self.end_time = self.to_abstime(end_day_index, end_time_of_day)
@@ -287,13 +291,14 @@ def solve(model, **kwargs):
 
 
 def load_data(model, shifts_, nurses_, nurse_skills, vacations_=None,
-              nurse_associations_=None, nurse_imcompatibilities_=None):
+              nurse_associations_=None, nurse_imcompatibilities_=None, skill_requirements_=None):
     """ Usage: load_data(shifts, nurses, nurse_skills, vacations) """
     model.number_of_overlaps = 0
     model.work_rules = DEFAULT_WORK_RULES
     model.shifts = [TShift(*shift_row) for shift_row in shifts_]
     model.nurses = [TNurse(*nurse_row) for nurse_row in nurses_]
-    model.skill_requirements = SKILL_REQUIREMENTS
+    model.skill_requirements = [TSkillRequirement(*skr) for skr in skill_requirements_]\
+    if skill_requirements_ is not None else SKILL_REQUIREMENTS
     model.nurse_skills = nurse_skills
     # transactional data
     model.vacations = [TVacation(*vacation_row) for vacation_row in vacations_] if vacations_ else []
@@ -319,6 +324,19 @@ def setup_data(model):
     model.shift_activities = {s: ShiftActivity(s.day, s.start_time, s.end_time) for s in model.shifts}
     # map from nurse names to nurse tuples.
     model.nurses_by_id = {n.name: n for n in model.nurses}
+    # lists of shifts by department and by day, of nurses by skill, in the order of shifts and nurses
+    shifts_by_department = defaultdict(list)
+    shifts_by_day = defaultdict(list)
+    for s in model.shifts:
+        shifts_by_department[s.department].append(s)
+        shifts_by_day[s.day].append(s)
+    nurses_by_skill = defaultdict(list)
+    for n in model.nurses:
+        for skill in set(model.nurse_skills.get(n.name, ())):
+            nurses_by_skill[skill].append(n)
+    model.shifts_by_department = dict(shifts_by_department)
+    model.shifts_by_day = dict(shifts_by_day)
+    model.nurses_by_skill = dict(nurses_by_skill)
 
 
 def setup_variables(model):
@@ -336,7 +354,7 @@ def setup_variables(model):
     model.average_nurse_work_time = model.continuous_var(lb=0, name='AverageWorkTime')
 
 
-def setup_constraints(model):
+def setup_constraints(model, overlap_cliques=False):
     all_nurses = model.nurses
     all_shifts = model.shifts
     nurse_assigned = model.nurse_assignment_vars
@@ -376,25 +394,27 @@ def setup_constraints(model):
     v = 0
     for vac_nurse_id, vac_day in model.vacations:
         vac_n = nurses_by_id[vac_nurse_id]
-        for shift in (s for s in all_shifts if s.day == vac_day):
+        for shift in model.shifts_by_day.get(vac_day, ()):
             v += 1
             model.add_constraint(nurse_assigned[vac_n, shift] == 0,
                                  "medium_vacations_{0!s}_{1!s}_{2!s}".format(vac_n, vac_day, shift))
     #print('#vacation cts: {0}'.format(v))
 
     # a nurse cannot be assigned overlapping shifts
-    # post only one constraint per couple(s1, s2)
-    number_of_overlaps = 0
-    nb_shifts = len(all_shifts)
-    for i1 in range(nb_shifts):
-        for i2 in range(i1 + 1, nb_shifts):
-            s1 = all_shifts[i1]
-            s2 = all_shifts[i2]
-            if shift_activities[s1].overlaps(shift_activities[s2]):
-                number_of_overlaps += 1
-                for n in all_nurses:
-                    model.add_constraint(nurse_assigned[n, s1] + nurse_assigned[n, s2] <= 1,
-                                         "high_overlapping_{0!s}_{1!s}_{2!s}".format(s1, s2, n))
+    if overlap_cliques:
+        # post one constraint per group of shifts which all overlap each other
+        for c, clique in enumerate(iter_overlapping_shift_cliques(all_shifts, shift_activities), start=1):
+            for n in all_nurses:
+                model.add_constraint(model.sum(nurse_assigned[n, s] for s in clique) <= 1,
+                                     "high_overlapping_clique_{0:d}_{1!s}".format(c, n))
+    else:
+        # post only one constraint per couple(s1, s2)
+        number_of_overlaps = 0
+        for s1, s2 in iter_overlapping_shifts(all_shifts, shift_activities):
+            number_of_overlaps += 1
+            for n in all_nurses:
+                model.add_constraint(nurse_assigned[n, s1] + nurse_assigned[n, s2] <= 1,
+                                     "high_overlapping_{0!s}_{1!s}_{2!s}".format(s1, s2, n))
     #print('# overlapping cts: {0}'.format(number_of_overlaps))
 
     for s in all_shifts:
@@ -408,11 +428,10 @@ def setup_constraints(model):
 
     for (dept, skill, required) in model.skill_requirements:
         if required > 0:
-            for dsh in (s for s in all_shifts if dept == s.department):
+            skilled_nurses = model.nurses_by_skill.get(skill, ())
+            for dsh in model.shifts_by_department.get(dept, ()):
                 model.add_constraint(model.sum(nurse_assigned[skilled_nurse, dsh] for skilled_nurse in
-                                               (n for n in all_nurses if
-                                                n.name in model.nurse_skills.keys() and skill in model.nurse_skills[
-                                                    n.name])) >= required,
+                                               skilled_nurses) >= required,
                                      "high_required_{0!s}_{1!s}_{2!s}_{3!s}".format(dept, skill, required, dsh))
 
     # nurse-nurse associations
@@ -474,40 +493,17 @@ def print_information(model):
     model.report_kpis()
 
 
-def print_solution(model):
-    print("*************************** Solution ***************************")
-    print("Allocation By Department:")
-    for d in model.departments:
-        print("\t{}: {}".format(d, sum(
-            model.nurse_assignment_vars[n, s].solution_value for n in model.nurses for s in model.shifts if
-            s.department == d)))
-    print("Cost By Department:")
-    for d in model.departments:
-        cost = sum(
-            model.nurse_assignment_vars[n, s].solution_value * n.pay_rate * model.shift_activities[s].duration for n in
-            model.nurses for s in model.shifts if s.department == d)
-        print("\t{}: {}".format(d, cost))
-    print("Nurses Assignments")
-    for n in sorted(model.nurses):
-        total_hours = sum(
-            model.nurse_assignment_vars[n, s].solution_value * model.shift_activities[s].duration for s in model.shifts)
-        print("\t{}: total hours:{}".format(n.name, total_hours))
-        for s in model.shifts:
-            if model.nurse_assignment_vars[n, s].solution_value == 1:
-                print("\t\t{}: {} {}-{}".format(s.day, s.department, s.start_time, s.end_time))
-
-
 # ----------------------------------------------------------------------------
 # Build the model
 # ----------------------------------------------------------------------------
 
-def build(context=None, **kwargs):
+def build(context=None, overlap_cliques=False, **kwargs):
     mdl = Model("Nurses", context=context, **kwargs)
     load_data(mdl, SHIFTS, NURSES, NURSE_SKILLS, VACATIONS, NURSE_ASSOCIATIONS,
               NURSE_INCOMPATIBILITIES)
     setup_data(mdl)
     setup_variables(mdl)
-    setup_constraints(mdl)
+    setup_constraints(mdl, overlap_cliques=overlap_cliques)
     setup_objective(mdl)
     return mdl
 
@@ -528,6 +524,10 @@ if __name__ == '__main__':
     # Save the CPLEX solution as "solution.json" program output
     with get_environment().get_output_stream("solution.json") as fp:
         model.solution.export(fp, "json")
+    # and the nurse assignments as "assignments.json", from values read once
+    assignments = get_assignment_values(model)
+    with get_environment().get_output_stream("assignments.json") as fp:
+        save_assignments_as_json(model, fp, assignments)
 
     model.end()
 
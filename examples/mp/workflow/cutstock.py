@@ -6,6 +6,7 @@
 
 from collections import namedtuple
 import json
+import textwrap
 
 from docplex.util.environment import get_environment
 from docplex.mp.model import Model
@@ -72,6 +73,9 @@ def make_cutstock_pattern_generation_model(items, roll_width, **kwargs):
 
 
 def cutstock_update_duals(gmodel, new_duals):
+    if isinstance(gmodel, CutstockPatternGeneratorDP):
+        gmodel.update_duals(new_duals)
+        return gmodel
     # update the duals array and the the duals expression...
     # edition is propagated to the objective of the model.
     gmodel.duals = new_duals
@@ -83,6 +87,96 @@ def cutstock_update_duals(gmodel, new_duals):
     return gmodel
 
 
+class CutstockPatternGeneratorDP(object):
+    """ Pattern generation by dynamic programming, an alternative to the MIP pattern-generation model.
+
+    The pricing problem is an integer knapsack: maximize the sum of item duals
+    over a pattern that fits in the roll width. Each item with a positive dual
+    is split in binary chunks (1, 2, 4, ... copies, up to the number of copies
+    that fit in the roll), and each chunk is a 0-1 item processed in one array
+    operation over all capacities 0..roll_width.
+
+    Item sizes and roll width must be integers. Requires numpy.
+    """
+
+    def __init__(self, items, roll_width):
+        import numpy as np
+        self.items = items
+        self.roll_width = int(roll_width)
+        self.sizes = np.array([it.size for it in items], dtype=np.int64)
+        if np.any(self.sizes != [it.size for it in items]) or self.roll_width != roll_width:
+            raise ValueError('dynamic programming pattern generation requires integer sizes and roll width')
+        self.duals = np.ones(len(items))
+        # binary chunks: (item index, number of copies)
+        self.chunks = []
+        for i, size in enumerate(self.sizes):
+            max_copies = self.roll_width // int(size)
+            mult = 1
+            while max_copies > 0:
+                copies = min(mult, max_copies)
+                self.chunks.append((i, copies))
+                max_copies -= copies
+                mult *= 2
+        self.objective_value = None
+
+    def update_duals(self, new_duals):
+        import numpy as np
+        assert len(new_duals) == len(self.items)
+        self.duals = np.asarray(new_duals, dtype=np.float64)
+
+    def _solve_table(self):
+        # returns the table of best dual values per capacity, and the chunks taken at each stage
+        import numpy as np
+        width = self.roll_width
+        best = np.zeros(width + 1)
+        stages = []
+        for i, copies in self.chunks:
+            value = copies * self.duals[i]
+            if value <= 0:
+                continue
+            weight = copies * int(self.sizes[i])
+            candidate = best[:width + 1 - weight] + value
+            taken = np.zeros(width + 1, dtype=bool)
+            taken[weight:] = candidate > best[weight:]
+            best[weight:] = np.where(taken[weight:], candidate, best[weight:])
+            stages.append((i, copies, weight, taken))
+        return best, stages
+
+    def _pattern_at(self, stages, capacity):
+        use_values = [0] * len(self.items)
+        for i, copies, weight, taken in reversed(stages):
+            if taken[capacity]:
+                use_values[i] += copies
+                capacity -= weight
+        return [float(u) for u in use_values]
+
+    def generate_patterns(self, nb_columns=1):
+        """ Returns a list of (reduced cost, item usages) tuples sorted by increasing reduced cost.
+
+        The first pattern is optimal, with the same reduced cost as the MIP pattern-generation model;
+        the others (nb_columns above 1) are the best distinct patterns fitting in smaller capacities.
+        """
+        import numpy as np
+        best, stages = self._solve_table()
+        # stable sort by decreasing value: ties keep the smallest capacity
+        capacities = np.argsort(-best, kind='stable') if nb_columns > 1 else [int(np.argmax(best))]
+        patterns = []
+        seen = set()
+        for capacity in capacities:
+            use_values = self._pattern_at(stages, int(capacity))
+            key = tuple(use_values)
+            if key not in seen:
+                seen.add(key)
+                patterns.append((1 - float(best[capacity]), use_values))
+                if len(patterns) >= nb_columns:
+                    break
+        self.objective_value = patterns[0][0]
+        return patterns
+
+    def end(self):
+        pass
+
+
 def make_custstock_master_model(item_table, pattern_table, fill_table, roll_width, **kwargs):
     m = Model(name='custock_master', **kwargs)
 
@@ -92,11 +186,23 @@ def make_custstock_master_model(item_table, pattern_table, fill_table, roll_widt
     m.patterns = [TPattern(*pattern_row) for pattern_row in pattern_table]
     m.patterns_by_id = {pat.id: pat for pat in m.patterns}
     m.max_pattern_id = max(pt.id for pt in m.patterns)
+    m.nb_initial_patterns = len(m.patterns)
 
-    # build a dictionary storing how much each pattern fills each item.
-    m.pattern_item_filled = {(m.patterns_by_id[p], m.items_by_id[i]): f for (p, i, f) in fill_table}
+    # build a dictionary storing how much each pattern fills each item, for nonzero fills only.
+    m.pattern_item_filled = {(m.patterns_by_id[p], m.items_by_id[i]): f for (p, i, f) in fill_table if f}
     m.roll_width = roll_width
 
+    # same data, indexed by pattern in compressed sparse row form: the entries of pattern m.patterns[r]
+    # are at positions m.pattern_fill_start[r] to m.pattern_fill_start[r+1] of the two entry lists.
+    pattern_entries = {p: [] for p in m.patterns}
+    for (p, item), f in m.pattern_item_filled.items():
+        pattern_entries[p].append((item, f))
+    m.pattern_fill_start = [0]
+    m.pattern_fill_items = []
+    m.pattern_fill_counts = []
+    for p in m.patterns:
+        cutstock_index_pattern_fill(m, pattern_entries[p])
+
     # --- variables
     # one cut var per pattern...
     m.MAX_CUT = 9999
@@ -121,82 +227,210 @@ def make_custstock_master_model(item_table, pattern_table, fill_table, roll_widt
     return m
 
 
+def cutstock_index_pattern_fill(master_model, entries):
+    """ Appends the (item, filled) entries of the last pattern to the pattern fill index. """
+    for item, filled in entries:
+        master_model.pattern_fill_items.append(item)
+        master_model.pattern_fill_counts.append(filled)
+    master_model.pattern_fill_start.append(len(master_model.pattern_fill_items))
+
+
+def cutstock_pattern_detail(master_model, r):
+    """ Returns a dictionary of filled quantities by item id, for pattern master_model.patterns[r].
+
+    Only nonzero fills are stored; generated patterns list every item, with zero fills.
+    """
+    start, end = master_model.pattern_fill_start[r], master_model.pattern_fill_start[r + 1]
+    detail = {} if r < master_model.nb_initial_patterns else {item.id: 0 for item in master_model.items}
+    detail.update((item.id, filled) for item, filled in zip(master_model.pattern_fill_items[start:end],
+                                                            master_model.pattern_fill_counts[start:end]))
+    return detail
+
+
 def add_pattern_to_master_model(master_model, item_usages):
     """ Adds a new pattern to the master model.
 
+    This is a batch of one pattern, see `add_patterns_to_master_model`.
+    """
+    return add_patterns_to_master_model(master_model, [item_usages])
+
+
+def add_patterns_to_master_model(master_model, item_usages_list):
+    """ Adds a batch of new patterns to the master model.
+
     This function performs the following:
 
-    1. build a new pattern instance from item usages (taken from sub-model)
-    2. add it to the master model
-    3. update decision objects with this new pattern.
+    1. build new pattern instances from item usages (taken from sub-model), one per
+       item usage vector, with ids taken from the `max_pattern_id` counter
+    2. add them to the master model, with one cut variable per pattern
+    3. write the nonzero coefficients of these new columns in the fill constraints, then in
+       the objective, with one call to the CPLEX engine each for the whole batch.
+
+    Editing the docplex expressions of the fill constraints and the objective instead would
+    be propagated to CPLEX as a rewrite of the whole objective, whose time grows with the
+    number of columns; written to the engine, the time to add a column does not grow (see
+    `bench_add_patterns` in cutstock_benchmark.py). The docplex expressions keep the initial
+    patterns only: the master model must be solved by its CPLEX engine, and exported with
+    `get_cplex().write()`. The patterns are described by `pattern_item_filled` and the
+    pattern fill index, see `cutstock_pattern_detail`.
     """
-    new_pattern_id = max(pt.id for pt in master_model.patterns) + 1
-    new_pattern = TPattern(new_pattern_id, 1)
-    master_model.patterns.append(new_pattern)
-    for used, item in zip(item_usages, master_model.items):
-        master_model.pattern_item_filled[new_pattern, item] = used
-
-    # --- add one decision variable, linked to the new pattern.
-    new_pattern_cut_var = master_model.continuous_var(lb=0, ub=master_model.MAX_CUT,
-                                                      name='cut_{0}'.format(new_pattern_id))
-    master_model.cut_vars[new_pattern] = new_pattern_cut_var
-
-    # update constraints
-    for item, ct in zip(master_model.items, master_model.item_fill_cts):
-        # update fill constraint by changing lhs
-        ctlhs = ct.lhs
-        filled = master_model.pattern_item_filled[new_pattern, item]
-        if filled:
-            ctlhs += new_pattern_cut_var * filled
-
-    # update objective:
-    #   side-effect on  the total cutting cost expr propagates to the objective.
-    cost_expr = master_model.total_cutting_cost
-    cost_expr += new_pattern_cut_var * new_pattern.cost  # this performw a side effect!
+    items = master_model.items
+    new_patterns = []
+    for item_usages in item_usages_list:
+        master_model.max_pattern_id += 1
+        new_pattern = TPattern(master_model.max_pattern_id, 1)
+        new_patterns.append(new_pattern)
+        master_model.patterns.append(new_pattern)
+        master_model.patterns_by_id[new_pattern.id] = new_pattern
+        entries = [(item, used) for item, used in zip(items, item_usages) if used]
+        for item, used in entries:
+            master_model.pattern_item_filled[new_pattern, item] = used
+        cutstock_index_pattern_fill(master_model, entries)
+
+    # --- add one decision variable per new pattern.
+    new_cut_vars = master_model.continuous_var_list(new_patterns, lb=0, ub=master_model.MAX_CUT,
+                                                    name=lambda p: 'cut_{0}'.format(p.id))
+    master_model.cut_vars.update(zip(new_patterns, new_cut_vars))
+
+    # --- write the new columns: (row, column, coefficient) triplets of the fill constraints,
+    # and the objective coefficients
+    cpx = master_model.get_cplex()
+    fill_rows = [ct.index for ct in master_model.item_fill_cts]
+    cpx.linear_constraints.set_coefficients([(fill_rows[i], cut_var.index, float(used))
+                                             for cut_var, item_usages in zip(new_cut_vars, item_usages_list)
+                                             for i, used in enumerate(item_usages) if used])
+    cpx.objective.set_linear([(cut_var.index, float(new_pattern.cost))
+                              for new_pattern, cut_var in zip(new_patterns, new_cut_vars)])
 
     return master_model
 
 
+def cutstock_generate_patterns(gmodel, nb_columns=1, **kwargs):
+    """ Solves the pattern-generation model with its current duals.
+
+    With nb_columns=1, the optimal pattern is returned. Otherwise, the model is
+    populated and the best distinct patterns of the solution pool are returned,
+    at most nb_columns of them.
+
+    The generator may also be a `CutstockPatternGeneratorDP` instance.
+
+    Returns:
+        A list of (reduced cost, item usages) tuples sorted by increasing reduced cost,
+        or None if the model fails to solve.
+    """
+    if isinstance(gmodel, CutstockPatternGeneratorDP):
+        return gmodel.generate_patterns(nb_columns)
+    use_vars = gmodel.use_vars
+    if nb_columns <= 1:
+        gs = gmodel.solve(**kwargs)
+        if not gs:
+            return None
+        return [(gmodel.objective_value, gs.get_values(use_vars))]
+
+    # keep the best nb_columns solutions in the pool (replace the worst ones)
+    gmodel.parameters.mip.pool.capacity = nb_columns
+    gmodel.parameters.mip.pool.replace = 1
+    gmodel.parameters.mip.limits.populate = 2 * nb_columns
+    pool = gmodel.populate_solution_pool(**kwargs)
+    if not pool:
+        return None
+    candidates = sorted(((sol.objective_value, sol.get_values(use_vars)) for sol in pool),
+                        key=lambda c: c[0])
+    patterns = []
+    seen = set()
+    for rc_cost, use_values in candidates:
+        key = tuple(int(round(u)) for u in use_values)
+        if key not in seen:
+            seen.add(key)
+            patterns.append((rc_cost, use_values))
+    return patterns[:nb_columns]
+
+
+def cutstock_iter_solution(model):
+    """ Iterates over the patterns used in the solution, as (pattern, number of cuts, pattern detail) tuples. """
+    patterns = model.patterns
+    cut_var_values = model.solution.get_values([model.cut_vars[p] for p in patterns])
+    for r, (p, cuts) in enumerate(zip(patterns, cut_var_values)):
+        if cuts >= 1e-3:
+            yield p, cuts, cutstock_pattern_detail(model, r)
+
+
 def cutstock_print_solution(cutstock_model):
-    patterns = cutstock_model.patterns
-    cut_var_values = {p: cutstock_model.cut_vars[p].solution_value for p in patterns}
-    pattern_item_filled = cutstock_model.pattern_item_filled
     print("| Nb of cuts | Pattern   | Pattern's detail (# of item1,item2,...) |")
     print("| {} |".format("-" * 70))
-    for p in patterns:
-        if cut_var_values[p] >= 1e-3:
-            pattern_detail = {b.id: pattern_item_filled[a, b] for a, b in pattern_item_filled if
-                              a == p}
-            print(
-                "| {:<10g} | {!s:9} | {!s:45} |".format(cut_var_values[p],
-                                                        p,
-                                                        pattern_detail))
+    for p, cuts, pattern_detail in cutstock_iter_solution(cutstock_model):
+        print(
+            "| {:<10g} | {!s:9} | {!s:45} |".format(cuts,
+                                                    p,
+                                                    pattern_detail))
     print("| {} |".format("-" * 70))
 
 
 def cutstock_save_as_json(model, json_file):
-    patterns = model.patterns
-    cut_var_values = {p: model.cut_vars[p].solution_value for p in patterns}
-    solution = []
-    for p in patterns:
-        if cut_var_values[p] >= 1e-3:
-            pattern_detail = {b.id: model.pattern_item_filled[(a, b)] for (a, b) in model.pattern_item_filled if
-                              a == p}
-            n = {'pattern': str(p),
-                 'cuts': "%g" % cut_var_values[p],
-                 'details': pattern_detail}
-            solution.append(n)
-    json_file.write(json.dumps(solution, indent=3).encode('utf-8'))
+    # the solution list is written one pattern at a time,
+    # with the same layout as json.dumps(solution, indent=3)
+    sep = '['
+    for p, cuts, pattern_detail in cutstock_iter_solution(model):
+        n = {'pattern': str(p),
+             'cuts': "%g" % cuts,
+             'details': pattern_detail}
+        json_file.write((sep + '\n' + textwrap.indent(json.dumps(n, indent=3), ' ' * 3)).encode('utf-8'))
+        sep = ','
+    json_file.write(('[]' if sep == '[' else '\n]').encode('utf-8'))
+
+
+def cutstock_lagrangian_bound(items, duals, rc_cost):
+    """ Returns the lower bound on the master objective given by duals and the minimum reduced cost.
+
+    This is Farley's bound: duals divided by the best pattern value (1 - rc_cost), when above 1,
+    are feasible for the dual of the master problem.
+    """
+    return sum(it.demand * d for it, d in zip(items, duals)) / max(1 - rc_cost, 1)
 
 
 def cutstock_solve(item_table, pattern_table, fill_table, roll_width, **kwargs):
+    """ Solves the cutting-stock problem by column generation.
+
+    Keyword arguments, besides those passed to the models and their solves:
+
+    - verbose: print iteration logs and the final solution (default is True)
+    - nb_columns: maximum number of negative reduced-cost patterns added to the master
+      model at each iteration (default is 1). Above 1, they are taken from the solution pool
+      of the pattern-generation model, and added in one batch.
+    - pricing: 'mip' (default) solves the pattern-generation model with CPLEX, 'dp' uses
+      `CutstockPatternGeneratorDP` instead. Dynamic programming gives exact reduced costs:
+      column generation then stops as with smoothing, see below.
+    - smoothing: Wentges dual smoothing factor, in [0, 1) (default is 0, no smoothing).
+      Patterns are priced with smoothing * center + (1 - smoothing) * duals, where the
+      stability center is the duals vector with the best Lagrangian bound so far.
+      When no pattern has a negative reduced cost for the master duals (mispricing), the
+      factor is decreased until pricing is done with the master duals.
+      Column generation stops when the master objective reaches the best bound, instead
+      of stopping when it is unchanged between two iterations.
+    - max_iterations: maximum number of master iterations (default is 100).
+
+    The number of iterations is stored in the `loop_count` attribute of the returned master model,
+    and per-iteration data (objective, bound, reduced cost, duals, added columns, mispricings)
+    in its `telemetry` list.
+    """
     verbose = kwargs.pop('verbose', True)
+    nb_columns = kwargs.pop('nb_columns', 1)
+    pricing = kwargs.pop('pricing', 'mip')
+    if pricing not in ('mip', 'dp'):
+        raise ValueError("pricing must be 'mip' or 'dp', {0!r} was passed".format(pricing))
+    smoothing = kwargs.pop('smoothing', 0)
+    if not 0 <= smoothing < 1:
+        raise ValueError("smoothing must be in [0, 1), {0!r} was passed".format(smoothing))
+    max_iterations = kwargs.pop('max_iterations', 100)
     master_model = make_custstock_master_model(item_table, pattern_table, fill_table, roll_width, **kwargs)
 
     # these two fields contain named tuples
     items = master_model.items
     patterns = master_model.patterns
-    gen_model = make_cutstock_pattern_generation_model(items, roll_width, **kwargs)
+    if pricing == 'dp':
+        gen_model = CutstockPatternGeneratorDP(items, roll_width)
+    else:
+        gen_model = make_cutstock_pattern_generation_model(items, roll_width, **kwargs)
 
     rc_eps = 1e-6
     obj_eps = 1e-4
@@ -204,8 +438,20 @@ def cutstock_solve(item_table, pattern_table, fill_table, roll_width, **kwargs):
     best = 0
     curr = 1e+20
     ms = None
+    # stabilization: best bound and the duals (stability center) giving it
+    best_bound = 0
+    center = None
+    telemetry = []
+    master_model.telemetry = telemetry
+
+    # with smoothing or exact pricing, reduced costs and the bound give the stopping test, not an
+    # unchanged master objective: it is unchanged after a degenerate iteration
+    stop_on_bound = smoothing or pricing == 'dp'
+
+    def keep_going():
+        return loop_count < max_iterations and (stop_on_bound or abs(best - curr) >= obj_eps)
 
-    while loop_count < 100 and abs(best - curr) >= obj_eps:
+    while keep_going():
         ms = master_model.solve(**kwargs)
         loop_count += 1
         best = curr
@@ -222,13 +468,42 @@ def cutstock_solve(item_table, pattern_table, fill_table, roll_width, **kwargs):
             if verbose:
                 print('{0}> moving duals from master to sub model: {1}'
                       .format(loop_count, list(map(lambda x: float('%0.2f' % x), duals))))
-            cutstock_update_duals(gen_model, duals)
-            gs = gen_model.solve(**kwargs)
-            if not gs:
+            if center is None:
+                center = duals
+            misprices = 0
+            while True:
+                alpha = max(0, 1 - (misprices + 1) * (1 - smoothing))
+                if alpha:
+                    sep_duals = [alpha * c + (1 - alpha) * d for c, d in zip(center, duals)]
+                else:
+                    sep_duals = duals
+                cutstock_update_duals(gen_model, sep_duals)
+                new_patterns = cutstock_generate_patterns(gen_model, nb_columns, **kwargs)
+                if not new_patterns:
+                    break
+                bound = cutstock_lagrangian_bound(items, sep_duals, new_patterns[0][0])
+                if bound > best_bound:
+                    best_bound = bound
+                    center = sep_duals
+                if not alpha:
+                    break
+                # reduced costs for the master duals
+                new_patterns = sorted(((1 - sum(u * d for u, d in zip(use_values, duals)), use_values)
+                                       for _, use_values in new_patterns), key=lambda p: p[0])
+                if new_patterns[0][0] <= -rc_eps:
+                    break
+                misprices += 1
+                if verbose:
+                    print('{}> mispricing with smoothed duals, alpha={:g}'.format(loop_count, alpha))
+            if not new_patterns:
                 print('{}> slave model fails, stop'.format(loop_count))
                 break
 
-            rc_cost = gen_model.objective_value
+            rc_cost = new_patterns[0][0]
+            new_use_values = [use_values for rc, use_values in new_patterns if rc <= -rc_eps]
+            telemetry.append({'iteration': loop_count, 'objective': curr, 'bound': best_bound,
+                              'reduced_cost': rc_cost, 'duals': list(duals),
+                              'nb_columns': len(new_use_values), 'misprices': misprices})
             if rc_cost <= -rc_eps:
                 if verbose:
                     print('{}> slave model runs with obj={:g}'.format(loop_count, rc_cost))
@@ -236,16 +511,22 @@ def cutstock_solve(item_table, pattern_table, fill_table, roll_width, **kwargs):
                 if verbose:
                     print('{}> pattern-generator model stops, obj={:g}'.format(loop_count, rc_cost))
                 break
+            if stop_on_bound and curr - best_bound < obj_eps:
+                if verbose:
+                    print('{}> master objective reaches bound={:g}, stop'.format(loop_count, best_bound))
+                break
 
-            use_values = gen_model.solution.get_values(gen_model.use_vars)
             if verbose:
-                print('{}> add new pattern to master data: {}'.format(loop_count, str(use_values)))
-            # make a new pattern with use values
-            if not (loop_count < 100 and abs(best - curr) >= obj_eps):
-                print('* terminating: best-curr={:g}'.format(abs(best - curr)))
+                for use_values in new_use_values:
+                    print('{}> add new pattern to master data: {}'.format(loop_count, str(use_values)))
+            # make new patterns with use values
+            if not keep_going():
+                if verbose:
+                    print('* terminating: best-curr={:g}'.format(abs(best - curr)))
                 break
-            add_pattern_to_master_model(master_model, use_values)
+            add_patterns_to_master_model(master_model, new_use_values)
 
+    master_model.loop_count = loop_count
     ret = None
     if ms:
         if verbose:
@@ -0,0 +1,219 @@
+# --------------------------------------------------------------------------
+# Source file provided under Apache License, Version 2.0, January 2004,
+# http://www.apache.org/licenses/
+# (c) Copyright IBM Corp. 2015, 2022
+# --------------------------------------------------------------------------
+
+"""
+Benchmarks for the cutting-stock column generation example (cutstock.py).
+
+Instances are generated at random with a fixed seed, so that runs are reproducible.
+
+Usage:
+    python cutstock_benchmark.py add [nb_items [nb_columns]]: time to add columns to the master model
+    python cutstock_benchmark.py multi [nb_items]: several columns per iteration
+    python cutstock_benchmark.py pricing [nb_items]: MIP versus dynamic programming pattern generation
+    python cutstock_benchmark.py stab [nb_items ...]: dual smoothing (instances of 50 to 500 items)
+"""
+
+import random
+import sys
+import time
+
+from cutstock import TItem, TPattern, make_custstock_master_model, add_patterns_to_master_model, cutstock_solve, \
+    make_cutstock_pattern_generation_model, CutstockPatternGeneratorDP, cutstock_update_duals, \
+    cutstock_generate_patterns
+
+
+def make_random_instance(nb_items, roll_width=1000, seed=0):
+    """ Generates a cutting-stock instance, in the format of `cutstock_solve` arguments.
+
+    Item sizes range from 5% to 40% of the roll width; the initial patterns cut
+    as many pieces as possible of a single item.
+
+    Returns:
+        A tuple (item_table, pattern_table, fill_table, roll_width).
+    """
+    rnd = random.Random(seed)
+    sizes = rnd.sample(range(roll_width // 20, 2 * roll_width // 5 + 1), nb_items)
+    item_table = [(i, size, rnd.randint(10, 100)) for i, size in enumerate(sizes, start=1)]
+    pattern_table = [(i, 1) for i in range(1, nb_items + 1)]
+    fill_table = [(i, i, roll_width // size) for (i, size, _) in item_table]
+    return item_table, pattern_table, fill_table, roll_width
+
+
+def random_patterns(items, roll_width, count, seed=0):
+    """ Generates feasible item usage vectors, as a pricing problem would. """
+    rnd = random.Random(seed)
+    patterns = []
+    for _ in range(count):
+        usage = [0] * len(items)
+        room = roll_width
+        for i in rnd.sample(range(len(items)), len(items)):
+            n = rnd.randint(0, room // items[i].size)
+            usage[i] = n
+            room -= n * items[i].size
+            if room < items[i].size:
+                break
+        patterns.append(usage)
+    return patterns
+
+
+def legacy_add_pattern_to_master_model(master_model, item_usages):
+    # add_pattern_to_master_model before batching: pattern id is a max over all patterns,
+    # and fill constraints are edited one term at a time.
+    new_pattern_id = max(pt.id for pt in master_model.patterns) + 1
+    new_pattern = TPattern(new_pattern_id, 1)
+    master_model.patterns.append(new_pattern)
+    for used, item in zip(item_usages, master_model.items):
+        master_model.pattern_item_filled[new_pattern, item] = used
+    new_pattern_cut_var = master_model.continuous_var(lb=0, ub=master_model.MAX_CUT,
+                                                      name='cut_{0}'.format(new_pattern_id))
+    master_model.cut_vars[new_pattern] = new_pattern_cut_var
+    for item, ct in zip(master_model.items, master_model.item_fill_cts):
+        ctlhs = ct.lhs
+        filled = master_model.pattern_item_filled[new_pattern, item]
+        if filled:
+            ctlhs += new_pattern_cut_var * filled
+    cost_expr = master_model.total_cutting_cost
+    cost_expr += new_pattern_cut_var * new_pattern.cost
+    return master_model
+
+
+def bench_add_patterns(nb_items=200, nb_columns=4000, batch_size=1, report_every=500):
+    """ Measures how the time to add a column to the master model grows with the number of columns.
+
+    The master model is solved once before adding columns so that every edit
+    is also forwarded to the CPLEX engine.
+    """
+    instance = make_random_instance(nb_items)
+    columns = None
+    timings = {}
+    for name in ('legacy', 'batched'):
+        master_model = make_custstock_master_model(*instance)
+        master_model.solve()
+        if columns is None:
+            columns = random_patterns(master_model.items, master_model.roll_width, nb_columns)
+        timings[name] = []
+        for start in range(0, nb_columns, batch_size):
+            batch = columns[start:start + batch_size]
+            t0 = time.perf_counter()
+            if name == 'legacy':
+                for usage in batch:
+                    legacy_add_pattern_to_master_model(master_model, usage)
+            else:
+                add_patterns_to_master_model(master_model, batch)
+            timings[name].append((time.perf_counter() - t0) / len(batch))
+        assert len(master_model.patterns) == nb_items + nb_columns
+        master_model.end()
+
+    print('* {} items, {} columns added by batches of {}: mean time per column (ms)'
+          .format(nb_items, nb_columns, batch_size))
+    print('| {:>15} | {:>10} | {:>10} |'.format('columns', 'legacy', 'batched'))
+    per_report = max(1, report_every // batch_size)
+    for r in range(0, len(timings['legacy']), per_report):
+        legacy = timings['legacy'][r:r + per_report]
+        batched = timings['batched'][r:r + per_report]
+        print('| {:>6} - {:>6} | {:>10.3f} | {:>10.3f} |'.format(
+            r * batch_size, min(nb_columns, (r + per_report) * batch_size),
+            1000 * sum(legacy) / len(legacy), 1000 * sum(batched) / len(batched)))
+
+
+def bench_solve(nb_items, configs, seeds=(0,), roll_width=1000):
+    """ Runs `cutstock_solve` on generated instances, once per configuration.
+
+    Args:
+        configs: a list of (name, keyword arguments of cutstock_solve) pairs.
+    """
+    print('* {} items, roll width {}'.format(nb_items, roll_width))
+    print('| {:>4} | {:<20} | {:>10} | {:>10} | {:>10} | {:>10} |'.format(
+        'seed', 'config', '#loops', '#patterns', 'objective', 'time (s)'))
+    for seed in seeds:
+        instance = make_random_instance(nb_items, roll_width, seed)
+        for name, solve_kwargs in configs:
+            t0 = time.perf_counter()
+            master_model, ms = cutstock_solve(*instance, verbose=False, **solve_kwargs)
+            elapsed = time.perf_counter() - t0
+            print('| {:>4} | {:<20} | {:>10} | {:>10} | {:>10.3f} | {:>10.2f} |'.format(
+                seed, name, master_model.loop_count, len(master_model.patterns),
+                ms.objective_value if ms else float('nan'), elapsed))
+            master_model.end()
+
+
+def bench_multi_column(nb_items=50, column_counts=(1, 5, 10, 20), seeds=(0, 1, 2)):
+    """ Compares iteration counts and wall time when adding several columns per iteration. """
+    bench_solve(nb_items, [('nb_columns={}'.format(k), dict(nb_columns=k)) for k in column_counts], seeds)
+
+
+def bench_pricing(nb_items=50, roll_widths=(500, 1000, 2000, 5000), nb_rounds=20, seed=0):
+    """ Compares the per-iteration latency of the MIP and dynamic programming pattern generators.
+
+    Both generators are given the same random duals, and must find the same reduced cost.
+    """
+    print('* {} items, {} pricing rounds per roll width: mean time per round (ms)'.format(nb_items, nb_rounds))
+    print('| {:>10} | {:>10} | {:>10} | {:>16} |'.format('roll width', 'mip', 'dp', 'same patterns'))
+    rnd = random.Random(seed)
+    for roll_width in roll_widths:
+        item_table = make_random_instance(nb_items, roll_width, seed)[0]
+        items = [TItem.make(row) for row in item_table]
+        generators = {'mip': make_cutstock_pattern_generation_model(items, roll_width),
+                      'dp': CutstockPatternGeneratorDP(items, roll_width)}
+        elapsed = dict.fromkeys(generators, 0.0)
+        nb_same = 0
+        for _ in range(nb_rounds):
+            # duals of a master LP are close to size / roll width
+            duals = [it.size / roll_width * rnd.uniform(0.8, 1.2) for it in items]
+            results = {}
+            for name, gen in generators.items():
+                t0 = time.perf_counter()
+                cutstock_update_duals(gen, duals)
+                results[name] = cutstock_generate_patterns(gen)[0]
+                elapsed[name] += time.perf_counter() - t0
+            assert abs(results['mip'][0] - results['dp'][0]) <= 1e-6, results
+            nb_same += [round(u) for u in results['mip'][1]] == [round(u) for u in results['dp'][1]]
+        generators['mip'].end()
+        print('| {:>10} | {:>10.3f} | {:>10.3f} | {:>10} / {:<3} |'.format(
+            roll_width, 1000 * elapsed['mip'] / nb_rounds, 1000 * elapsed['dp'] / nb_rounds, nb_same, nb_rounds))
+
+
+def bench_stabilization(sizes=(50, 100), smoothings=(0, 0.5, 0.8, 0.9), seeds=(0, 1, 2), max_iterations=1000):
+    """ Compares iteration counts with and without dual smoothing, using dynamic programming pricing.
+
+    For each run, the final gap is the master objective minus the best Lagrangian bound.
+    """
+    print('| {:>6} | {:>4} | {:>9} | {:>7} | {:>10} | {:>10} | {:>10} | {:>8} |'.format(
+        'items', 'seed', 'smoothing', '#loops', '#misprices', 'objective', 'gap', 'time (s)'))
+    for nb_items in sizes:
+        for seed in seeds:
+            instance = make_random_instance(nb_items, seed=seed)
+            for smoothing in smoothings:
+                t0 = time.perf_counter()
+                master_model, ms = cutstock_solve(*instance, verbose=False, pricing='dp', smoothing=smoothing,
+                                                  max_iterations=max_iterations)
+                elapsed = time.perf_counter() - t0
+                telemetry = master_model.telemetry
+                last = telemetry[-1]
+                print('| {:>6} | {:>4} | {:>9g} | {:>7} | {:>10} | {:>10.3f} | {:>10.2e} | {:>8.2f} |'.format(
+                    nb_items, seed, smoothing, master_model.loop_count, sum(t['misprices'] for t in telemetry),
+                    ms.objective_value, last['objective'] - last['bound'], elapsed))
+                master_model.end()
+
+
+if __name__ == '__main__':
+    bench = sys.argv[1] if len(sys.argv) > 1 else 'add'
+    if bench == 'add':
+        nb_items = int(sys.argv[2]) if len(sys.argv) > 2 else 200
+        nb_columns = int(sys.argv[3]) if len(sys.argv) > 3 else 4000
+        bench_add_patterns(nb_items, nb_columns)
+        bench_add_patterns(nb_items, nb_columns, batch_size=10)
+    elif bench == 'multi':
+        bench_multi_column(int(sys.argv[2]) if len(sys.argv) > 2 else 50)
+    elif bench == 'pricing':
+        nb_items = int(sys.argv[2]) if len(sys.argv) > 2 else 50
+        bench_pricing(nb_items)
+        bench_solve(nb_items, [('pricing=mip', dict(pricing='mip')), ('pricing=dp', dict(pricing='dp'))])
+    elif bench == 'stab':
+        bench_stabilization([int(a) for a in sys.argv[2:]] or (50, 100))
+    else:
+        print('Usage: {} add [nb_items [nb_columns]] | multi [nb_items] | pricing [nb_items] | stab [nb_items ...]'
+              .format(sys.argv[0]))
@@ -6,6 +6,11 @@
 
 import json
 import builtins
+import multiprocessing
+import os
+import random
+import time
+from concurrent.futures import ProcessPoolExecutor
 
 from docplex.util.environment import get_environment
 from docplex.mp.model import Model
@@ -58,7 +63,77 @@ def run_GAP_model(As, Bs, Cs, **kwargs):
     return obj
 
 
-def run_GAP_model_with_Lagrangian_relaxation(As, Bs, Cs, max_iters=101, **kwargs):
+def GAP_greedy_heuristic(As, Bs, Cs):
+    """ A cheap feasible solution: (job, agent) pairs are assigned by decreasing profit per unit of weight.
+
+    :return: the total profit, and the agent of each job (None if unassigned).
+    """
+    remaining = list(Bs)
+    assignment = [None] * len(Cs)
+    pairs = sorted(((i, j) for i, c_i in enumerate(Cs) for j in range(len(c_i))),
+                   key=lambda ij: -Cs[ij[0]][ij[1]] / As[ij[0]][ij[1]])
+    profit = 0
+    for i, j in pairs:
+        if assignment[i] is None and As[i][j] <= remaining[j]:
+            assignment[i] = j
+            remaining[j] -= As[i][j]
+            profit += Cs[i][j]
+    return profit, assignment
+
+
+class SubgradientStep(object):
+    """ Step sizes for the multiplier updates, minimizing the Lagrangian bound.
+
+    - 'harmonic': 1/k at iteration k.
+    - 'polyak': theta * (bound - lower_bound) / |g|^2, where g is the subgradient and
+      lower_bound the value of a feasible solution.
+    - 'adaptive': Polyak step, where theta is halved after `patience` iterations without
+      improvement of the best bound.
+    """
+    rules = ('harmonic', 'polyak', 'adaptive')
+
+    def __init__(self, rule='harmonic', lower_bound=0, theta=1.0, patience=3):
+        if rule not in self.rules:
+            raise ValueError('step rule must be one of {}, {!r} was passed'.format(self.rules, rule))
+        self.rule = rule
+        self.lower_bound = lower_bound
+        self.theta = theta
+        self.patience = patience
+        self._best = None
+        self._nb_not_improved = 0
+
+    def next_step(self, loop_count, bound, subgradient):
+        if self.rule == 'harmonic':
+            return 1.0 / float(loop_count)
+        if self.rule == 'adaptive':
+            if self._best is None or bound < self._best:
+                self._best = bound
+                self._nb_not_improved = 0
+            else:
+                self._nb_not_improved += 1
+                if self._nb_not_improved >= self.patience:
+                    self.theta /= 2
+                    self._nb_not_improved = 0
+        norm2 = sum(g * g for g in subgradient)
+        if not norm2:
+            return 0.
+        return self.theta * builtins.max(bound - self.lower_bound, 0.) / norm2
+
+
+def make_subgradient_step(As, Bs, Cs, step_rule):
+    # Polyak steps need a lower bound, given by the greedy heuristic
+    lower_bound = GAP_greedy_heuristic(As, Bs, Cs)[0] if step_rule != 'harmonic' else 0
+    return SubgradientStep(step_rule, lower_bound)
+
+
+def run_GAP_model_with_Lagrangian_relaxation(As, Bs, Cs, max_iters=101, step_rule='harmonic', trace=None,
+                                             **kwargs):
+    """ Lagrangian relaxation of the assignment constraints, on one model.
+
+    :param step_rule: the step size rule of multiplier updates, see `SubgradientStep`
+    :param trace: if a list is passed, one dict per iteration is appended to it, with the bound,
+        the step, the violation (sum of penalized violations) and the wall time since start.
+    """
     with Model('GAP per Wolsey -with- Lagrangian Relaxation', **kwargs) as mdl:
         print("#As={}, #Bs={}, #Cs={}".format(len(As), len(Bs), len(Cs)))
         number_of_cs = len(Cs)
@@ -82,11 +157,16 @@ def run_GAP_model_with_Lagrangian_relaxation(As, Bs, Cs, max_iters=101, **kwargs
         total_profit = mdl.sum(mdl.scal_prod(x_i, c_i) for c_i, x_i in zip(Cs, x_vars))
         mdl.add_kpi(total_profit, "Total profit")
 
+        # the penalty coefficients (multipliers) are edited in place, in the penalty
+        # expression and in the objective
+        total_penalty = mdl.scal_prod(p_vars, multipliers)
+        objective_expr = total_profit + total_penalty
+        mdl.maximize(objective_expr)
+        step_size = make_subgradient_step(As, Bs, Cs, step_rule)
+        start_time = time.time()
+
         while loop_count <= max_iters:
             loop_count += 1
-            # rebuilt at each loop iteration
-            total_penalty = mdl.scal_prod(p_vars, multipliers)
-            mdl.maximize(total_profit + total_penalty)
             s = mdl.solve()
             if not s:
                 print("*** solve fails, stopping at iteration: %d" % loop_count)
@@ -104,19 +184,182 @@ def run_GAP_model_with_Lagrangian_relaxation(As, Bs, Cs, max_iters=101, **kwargs
                     justifier = penalized_violation
                     break
 
+            step = 0. if do_stop else step_size.next_step(loop_count, best, penalties)
+            if trace is not None:
+                trace.append({'iteration': loop_count, 'bound': best, 'step': step,
+                              'violation': sum(p * m for p, m in zip(penalties, multipliers)),
+                              'time': time.time() - start_time})
             if do_stop:
                 print("* Lagrangian relaxation succeeds, best={:g}, penalty={:g}, #iterations={}"
                       .format(best, total_penalty.solution_value, loop_count))
                 break
             else:
                 # update multipliers and start loop again.
-                scale_factor = 1.0 / float(loop_count)
-                multipliers = [builtins.max(multipliers[i] - scale_factor * penalties[i], 0.) for i in c_range]
+                multipliers = [builtins.max(multipliers[i] - step * penalties[i], 0.) for i in c_range]
+                penalty_coefs = list(zip(p_vars, multipliers))
+                total_penalty.set_coefficients(penalty_coefs)
+                objective_expr.set_coefficients(penalty_coefs)
                 print('{0}> -- loop continues, m={1!s}, justifier={2:g}'.format(loop_count, multipliers, justifier))
 
     return best
 
 
+# ----------------------------------------------------------------------------
+# Decomposed Lagrangian relaxation
+#
+# Once the assignment constraints are dualized, the relaxed GAP splits into one
+# knapsack problem per agent: these are solved in a pool of worker processes.
+# ----------------------------------------------------------------------------
+def make_random_GAP_data(nb_jobs, nb_agents, seed=0, tightness=0.8):
+    """ Generates a GAP instance, with the same layout as A, B, C: one row per job, one column per agent.
+
+    Weights are drawn in [5, 25], profits in [10, 50], and each agent capacity is
+    its total weight divided by the number of agents, times tightness.
+    """
+    rnd = random.Random(seed)
+    As = [[rnd.randint(5, 25) for _ in range(nb_agents)] for _ in range(nb_jobs)]
+    Cs = [[rnd.randint(10, 50) for _ in range(nb_agents)] for _ in range(nb_jobs)]
+    Bs = [int(tightness * sum(a_i[j] for a_i in As) / nb_agents) for j in range(nb_agents)]
+    return As, Bs, Cs
+
+
+# per-process data: the instance, and one knapsack model per agent of the process, built on first use
+_agent_data = None
+_agent_models = {}
+
+
+def _init_agent_models(As, Bs, Cs, model_kwargs):
+    global _agent_data
+    _end_agent_models()
+    _agent_data = (As, Bs, Cs, model_kwargs)
+
+
+def _end_agent_models():
+    for mdl in _agent_models.values():
+        mdl.end()
+    _agent_models.clear()
+
+
+def _get_agent_model(j):
+    mdl = _agent_models.get(j)
+    if mdl is None:
+        As, Bs, Cs, model_kwargs = _agent_data
+        mdl = Model('GAP agent {} knapsack'.format(j), **model_kwargs)
+        mdl.x_vars = mdl.binary_var_list(len(Cs), name=None)
+        mdl.add_constraint(mdl.scal_prod(mdl.x_vars, (a_i[j] for a_i in As)) <= Bs[j])
+        # profits are edited in place at each iteration
+        mdl.profit_expr = mdl.scal_prod(mdl.x_vars, (c_i[j] for c_i in Cs))
+        mdl.maximize(mdl.profit_expr)
+        # the Lagrangian bound needs optimal knapsack values
+        mdl.parameters.mip.tolerances.mipgap = 0
+        # knapsacks are solved concurrently by one process per core
+        mdl.parameters.threads = 1
+        _agent_models[j] = mdl
+    return mdl
+
+
+def solve_agent_knapsacks(agents, multipliers):
+    """ Solves the knapsack problems of some agents, with profits reduced by the multipliers.
+
+    :return: a list of (agent, knapsack upper bound, list of assigned jobs) tuples.
+    """
+    Cs = _agent_data[2]
+    results = []
+    for j in agents:
+        mdl = _get_agent_model(j)
+        mdl.profit_expr.set_coefficients([(x, c_i[j] - m_i) for x, c_i, m_i in zip(mdl.x_vars, Cs, multipliers)])
+        s = mdl.solve()
+        if not s:
+            raise RuntimeError('knapsack of agent {} fails to solve'.format(j))
+        assigned = [i for i, v in enumerate(s.get_values(mdl.x_vars)) if v >= 0.5]
+        results.append((j, mdl.solve_details.best_bound, assigned))
+    return results
+
+
+def run_GAP_model_with_Lagrangian_decomposition(As, Bs, Cs, max_iters=101, nb_workers=None, step_rule='harmonic',
+                                                trace=None, **kwargs):
+    """ Lagrangian relaxation of the assignment constraints, solved by agent.
+
+    At each iteration, the per-agent knapsack problems are solved concurrently in
+    nb_workers processes (default is the number of cores; 1 solves them in this process).
+    Their values are combined into the Lagrangian bound, and the count of agents each job
+    is assigned to gives the subgradient of the multipliers.
+    Agents are split among workers once: each worker builds and keeps the knapsack models
+    of its agents only, and solves them with one CPLEX thread.
+
+    step_rule and trace are as in `run_GAP_model_with_Lagrangian_relaxation`; the violation
+    is the number of extra assignments of jobs assigned to several agents.
+
+    :return: the best (lowest) Lagrangian bound found.
+    """
+    nb_jobs, nb_agents = len(Cs), len(Bs)
+    print("#As={}, #Bs={}, #Cs={}".format(len(As), len(Bs), len(Cs)))
+    if nb_workers is None:
+        nb_workers = os.cpu_count() or 1
+    nb_workers = builtins.min(nb_workers, nb_agents)
+    # one chunk of agents per worker, pinned to it: a single-process executor per worker
+    chunks = [list(range(k, nb_agents, nb_workers)) for k in range(nb_workers)]
+
+    pools = []
+    if nb_workers > 1:
+        context = multiprocessing.get_context('spawn')
+        pools = [ProcessPoolExecutor(1, mp_context=context, initializer=_init_agent_models,
+                                     initargs=(As, Bs, Cs, kwargs)) for _ in chunks]
+
+        def solve_chunks(multipliers):
+            futures = [pool.submit(solve_agent_knapsacks, chunk, multipliers) for pool, chunk in zip(pools, chunks)]
+            return [future.result() for future in futures]
+    else:
+        _init_agent_models(As, Bs, Cs, kwargs)
+
+        def solve_chunks(multipliers):
+            return [solve_agent_knapsacks(chunks[0], multipliers)]
+
+    eps = 1e-6
+    loop_count = 0
+    best = None
+    initial_multiplier = 1
+    multipliers = [initial_multiplier] * nb_jobs
+    step_size = make_subgradient_step(As, Bs, Cs, step_rule)
+    start_time = time.time()
+    try:
+        while loop_count <= max_iters:
+            loop_count += 1
+            bound = sum(multipliers)
+            nb_assigned = [0] * nb_jobs
+            for results in solve_chunks(multipliers):
+                for _, obj, assigned in results:
+                    bound += obj
+                    for i in assigned:
+                        nb_assigned[i] += 1
+            # subgradient: 1 - number of agents a job is assigned to
+            subgradient = [1 - n for n in nb_assigned]
+            best = bound if best is None else builtins.min(best, bound)
+            nb_violated = sum(1 for g in subgradient if g < 0)
+            print('%d> new lagrangian iteration: bound=%g, best=%g, #jobs assigned more than once=%d'
+                  % (loop_count, bound, best, nb_violated))
+
+            do_stop = nb_violated == 0 and all(abs(g * m) < eps for g, m in zip(subgradient, multipliers))
+            step = 0. if do_stop else step_size.next_step(loop_count, bound, subgradient)
+            if trace is not None:
+                trace.append({'iteration': loop_count, 'bound': bound, 'step': step,
+                              'violation': -sum(g for g in subgradient if g < 0),
+                              'time': time.time() - start_time})
+            if do_stop:
+                print("* Lagrangian decomposition succeeds, best={:g}, #iterations={}".format(best, loop_count))
+                break
+            # update multipliers and start loop again.
+            multipliers = [builtins.max(m - step * g, 0.) for m, g in zip(multipliers, subgradient)]
+    finally:
+        if pools:
+            for pool in pools:
+                pool.shutdown()
+        else:
+            _end_agent_models()
+
+    return best
+
+
 def run_default_GAP_model_with_lagrangian_relaxation(**kwargs):
     return run_GAP_model_with_Lagrangian_relaxation(As=A, Bs=B, Cs=C, **kwargs)
 
@@ -0,0 +1,84 @@
+# --------------------------------------------------------------------------
+# Source file provided under Apache License, Version 2.0, January 2004,
+# http://www.apache.org/licenses/
+# (c) Copyright IBM Corp. 2015, 2018
+# --------------------------------------------------------------------------
+
+"""
+Benchmarks for the Lagrangian relaxation example (lagrangian_relaxation.py),
+on GAP instances generated by `make_random_GAP_data` with a fixed seed.
+
+Usage:
+    python lagrangian_relaxation_benchmark.py workers [nb_agents [nb_jobs [nb_iters]]]
+    python lagrangian_relaxation_benchmark.py steps [nb_agents [nb_jobs [nb_iters]]]
+"""
+
+import contextlib
+import io
+import os
+import sys
+import time
+
+from lagrangian_relaxation import make_random_GAP_data, run_GAP_model_with_Lagrangian_decomposition, \
+    run_GAP_model_with_Lagrangian_relaxation, GAP_greedy_heuristic, SubgradientStep
+
+
+def bench_workers(nb_agents=100, nb_jobs=1000, nb_iters=10, worker_counts=None, seed=0):
+    """ Compares the time of decomposed Lagrangian iterations for several numbers of worker processes. """
+    As, Bs, Cs = make_random_GAP_data(nb_jobs, nb_agents, seed)
+    if worker_counts is None:
+        worker_counts = sorted({1, 2, os.cpu_count() or 1})
+    rows = []
+    for nb_workers in worker_counts:
+        t0 = time.perf_counter()
+        bound = run_GAP_model_with_Lagrangian_decomposition(As, Bs, Cs, max_iters=nb_iters - 1,
+                                                            nb_workers=nb_workers)
+        rows.append((nb_workers, bound, time.perf_counter() - t0))
+    print('* {} agents, {} jobs, {} iterations'.format(nb_agents, nb_jobs, nb_iters))
+    print('| {:>8} | {:>12} | {:>10} | {:>8} |'.format('workers', 'best bound', 'time (s)', 'speedup'))
+    for nb_workers, bound, elapsed in rows:
+        print('| {:>8} | {:>12.2f} | {:>10.2f} | {:>8.2f} |'.format(nb_workers, bound, elapsed, rows[0][2] / elapsed))
+
+
+def bench_step_rules(nb_agents=20, nb_jobs=200, nb_iters=100, checkpoints=(10, 25, 50, 100), seed=0,
+                     tightness=0.5, decomposed=True):
+    """ Compares the convergence of the Lagrangian bound for each step rule, from the iteration traces.
+
+    For each rule, prints the best bound reached at some iterations, and the wall time.
+    """
+    As, Bs, Cs = make_random_GAP_data(nb_jobs, nb_agents, seed, tightness)
+    lower_bound = GAP_greedy_heuristic(As, Bs, Cs)[0]
+    print('* {} agents, {} jobs, {}, greedy lower bound={:g}'.format(
+        nb_agents, nb_jobs, 'one model per agent' if decomposed else 'one model', lower_bound))
+    print('| {:<9} | '.format('rule') + ' | '.join('{:>10}'.format('iter {}'.format(k)) for k in checkpoints) +
+          ' | {:>7} | {:>9} |'.format('#iters', 'time (s)'))
+    for rule in SubgradientStep.rules:
+        trace = []
+        # iteration logs are not printed
+        with contextlib.redirect_stdout(io.StringIO()):
+            if decomposed:
+                run_GAP_model_with_Lagrangian_decomposition(As, Bs, Cs, max_iters=nb_iters - 1, nb_workers=1,
+                                                            step_rule=rule, trace=trace)
+            else:
+                run_GAP_model_with_Lagrangian_relaxation(As, Bs, Cs, max_iters=nb_iters - 1, step_rule=rule,
+                                                         trace=trace)
+        best_bounds = []
+        best = None
+        for t in trace:
+            best = t['bound'] if best is None else min(best, t['bound'])
+            best_bounds.append(best)
+        print('| {:<9} | '.format(rule) +
+              ' | '.join('{:>10.2f}'.format(best_bounds[min(k, len(trace)) - 1]) for k in checkpoints) +
+              ' | {:>7} | {:>9.2f} |'.format(len(trace), trace[-1]['time']))
+
+
+if __name__ == '__main__':
+    bench = sys.argv[1] if len(sys.argv) > 1 else 'workers'
+    args = [int(a) for a in sys.argv[2:]]
+    if bench == 'workers':
+        bench_workers(*args)
+    elif bench == 'steps':
+        bench_step_rules(*args)
+        bench_step_rules(*args, decomposed=False)
+    else:
+        print('Usage: {} workers|steps [nb_agents [nb_jobs [nb_iters]]]'.format(sys.argv[0]))
@@ -0,0 +1,267 @@
+# --------------------------------------------------------------------------
+# Source file provided under Apache License, Version 2.0, January 2004,
+# http://www.apache.org/licenses/
+# (c) Copyright IBM Corp. 2015, 2022
+# --------------------------------------------------------------------------
+
+"""
+An on-disk cache of parsed models, for examples that read the same model file many times.
+
+The first read of a file parses it with `ModelReader.read` and saves the model in the
+CPLEX SAV format, which loads faster than LP or MPS. Later reads load the SAV file.
+
+A cache entry is keyed by the content hash of the model file; the hash is recomputed only
+when the path, size or modification time of the file changes. The total size of the
+cache is bounded: least recently read entries are removed first, and model files whose
+entries are all removed are dropped from the index.
+
+The default cache directory is private to the user: it is DOCPLEX_MODEL_CACHE_DIR if set,
+else docplex/model_cache in the user cache directory (XDG_CACHE_HOME or ~/.cache), created
+with 0o700 permissions. It can be shared by several processes of the user. Files are written
+under a temporary name then renamed, so that a process never reads a partial file, and the
+index is updated under a lock file, so that concurrent updates are not lost.
+"""
+
+import contextlib
+import hashlib
+import json
+import os
+import tempfile
+import time
+
+from docplex.mp.model_reader import ModelReader
+
+DEFAULT_MAX_SIZE = 512 * 1024 * 1024
+
+
+def file_content_hash(filename, chunk_size=1 << 20):
+    """ Returns the SHA-1 digest of the content of a file. """
+    digest = hashlib.sha1()
+    with open(filename, 'rb') as f:
+        for chunk in iter(lambda: f.read(chunk_size), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def _write_replace(path, write_fn):
+    # writes through write_fn(tmp_path) then renames, so that readers never see a partial file
+    # hidden temporary files are not listed as cache entries
+    fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path), prefix='.', suffix=os.path.splitext(path)[1])
+    os.close(fd)
+    try:
+        write_fn(tmp_path)
+        os.replace(tmp_path, path)
+    finally:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+
+
+@contextlib.contextmanager
+def _file_lock(lock_path, timeout=30.0, stale_age=60.0):
+    # an exclusive lock, held while the lock file exists; a lock file older than stale_age
+    # seconds is left by a process that died and is removed
+    deadline = time.time() + timeout
+    while True:
+        try:
+            fd = os.open(lock_path, os.O_CREAT | os.O_EXCL | os.O_WRONLY, 0o600)
+            break
+        except FileExistsError:
+            try:
+                if time.time() - os.stat(lock_path).st_mtime > stale_age:
+                    os.remove(lock_path)
+                    continue
+            except OSError:
+                # released meanwhile
+                continue
+            if time.time() > deadline:
+                raise TimeoutError('Cannot lock {0}'.format(lock_path))
+            time.sleep(0.01)
+    try:
+        yield
+    finally:
+        os.close(fd)
+        os.remove(lock_path)
+
+
+def default_cache_dir():
+    """ Returns the default cache directory, see module documentation. """
+    cache_dir = os.environ.get('DOCPLEX_MODEL_CACHE_DIR')
+    if not cache_dir:
+        cache_home = os.environ.get('XDG_CACHE_HOME') or os.path.join(os.path.expanduser('~'), '.cache')
+        cache_dir = os.path.join(cache_home, 'docplex', 'model_cache')
+    return cache_dir
+
+
+class ModelCache(object):
+    """ A size-bounded cache of parsed model files, see module documentation.
+
+    :param cache_dir: the cache directory, created if needed with 0o700 permissions
+        (default is `default_cache_dir()`)
+    :param max_size: the maximum total size of cached models, in bytes
+    """
+    INDEX_NAME = 'index.json'
+    LOCK_NAME = 'index.lock'
+
+    def __init__(self, cache_dir=None, max_size=DEFAULT_MAX_SIZE):
+        if cache_dir is None:
+            cache_dir = default_cache_dir()
+        os.makedirs(cache_dir, mode=0o700, exist_ok=True)
+        self.cache_dir = cache_dir
+        self.max_size = max_size
+        self.nb_hits = 0
+        self.nb_misses = 0
+
+    def _load_index(self):
+        try:
+            with open(os.path.join(self.cache_dir, self.INDEX_NAME)) as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return {}
+
+    def _save_index(self, index):
+        def write_index(path):
+            with open(path, 'w') as f:
+                json.dump(index, f)
+        _write_replace(os.path.join(self.cache_dir, self.INDEX_NAME), write_index)
+
+    def _update_index(self, update_fn):
+        # re-reads the index and applies update_fn to it under the lock; update_fn returns
+        # True if it changed the index, which is then saved
+        with _file_lock(os.path.join(self.cache_dir, self.LOCK_NAME)):
+            index = self._load_index()
+            if update_fn(index):
+                self._save_index(index)
+
+    def _record_entry(self, filename, sav_path):
+        # records that the SAV file is an entry for the model file, so that the index keeps it
+        path = os.path.abspath(filename)
+        sav_name = os.path.basename(sav_path)
+
+        def add_entry(index):
+            entry = index.get(path)
+            if entry is None or sav_name in entry.setdefault('entries', []):
+                return False
+            entry['entries'].append(sav_name)
+            return True
+        self._update_index(add_entry)
+
+    def content_hash(self, filename):
+        """ Returns the content hash of a file, reusing the one in the index if the file did not change. """
+        path = os.path.abspath(filename)
+        st = os.stat(path)
+        index = self._load_index()
+        entry = index.get(path)
+        if entry and entry['mtime_ns'] == st.st_mtime_ns and entry['size'] == st.st_size:
+            return entry['hash']
+        content_hash = file_content_hash(path)
+
+        def set_hash(index):
+            index[path] = {'mtime_ns': st.st_mtime_ns, 'size': st.st_size, 'hash': content_hash}
+            return True
+        self._update_index(set_hash)
+        return content_hash
+
+    def entry_path(self, filename, **kwargs):
+        """ Returns the path of the SAV file for a model file, read with kwargs. """
+        key = self.content_hash(filename)
+        if kwargs:
+            # reading options such as ignore_names change the parsed model
+            key = hashlib.sha1('{0}{1!r}'.format(key, sorted(kwargs.items())).encode()).hexdigest()
+        return os.path.join(self.cache_dir, key + '.sav')
+
+    def read(self, filename, model_name=None, **kwargs):
+        """ Reads a model file through the cache.
+
+        Arguments are those of `ModelReader.read`; the model name defaults to the
+        basename of filename, as when reading it directly.
+
+        :return: the model instance, or None if the file cannot be read.
+        """
+        if model_name is None:
+            basename = os.path.basename(filename)
+            dotpos = basename.find('.')
+            model_name = basename[:dotpos] if dotpos > 0 else basename
+        sav_path = self.entry_path(filename, **kwargs)
+        if os.path.exists(sav_path):
+            mdl = ModelReader.read(sav_path, model_name=model_name, **kwargs)
+            if mdl:
+                self.nb_hits += 1
+                # mark the entry as recently used
+                os.utime(sav_path)
+                self._record_entry(filename, sav_path)
+                return mdl
+        self.nb_misses += 1
+        mdl = ModelReader.read(filename, model_name=model_name, **kwargs)
+        if mdl:
+            _write_replace(sav_path, mdl.export_as_sav)
+            self._record_entry(filename, sav_path)
+            self.evict()
+        return mdl
+
+    def entries(self):
+        """ Returns the list of (path, size, last use time) of cached models, least recently used first. """
+        entries = []
+        for name in os.listdir(self.cache_dir):
+            if name.endswith('.sav') and not name.startswith('.'):
+                path = os.path.join(self.cache_dir, name)
+                try:
+                    st = os.stat(path)
+                except OSError:
+                    # removed by another process
+                    continue
+                entries.append((path, st.st_size, st.st_mtime))
+        entries.sort(key=lambda e: e[2])
+        return entries
+
+    def evict(self):
+        """ Removes least recently used models until the cache fits in its maximum size,
+        then removes the model files without cached models from the index.
+        """
+        entries = self.entries()
+        total_size = sum(size for _, size, _ in entries)
+        for path, size, _ in entries:
+            if total_size <= self.max_size:
+                break
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+            total_size -= size
+
+        def prune(index):
+            # checks the files on disk, as other processes may have added entries since the listing
+            removed = [path for path, entry in index.items()
+                       if not any(os.path.exists(os.path.join(self.cache_dir, name))
+                                  for name in entry.get('entries', ()))]
+            for path in removed:
+                del index[path]
+            return bool(removed)
+        self._update_index(prune)
+
+    def clear(self):
+        """ Removes all cached models and the index. """
+        with _file_lock(os.path.join(self.cache_dir, self.LOCK_NAME)):
+            for path, _, _ in self.entries():
+                os.remove(path)
+            index_path = os.path.join(self.cache_dir, self.INDEX_NAME)
+            if os.path.exists(index_path):
+                os.remove(index_path)
+
+
+_default_cache = None
+
+
+def get_default_model_cache():
+    """ Returns the cache used by the examples, in the default directory. """
+    global _default_cache
+    if _default_cache is None:
+        _default_cache = ModelCache()
+    return _default_cache
+
+
+def read_model(filename, model_cache=None, **kwargs):
+    """ Reads a model file through a cache (default is `get_default_model_cache()`).
+
+    :return: the model instance, or None if the file cannot be read.
+    """
+    return (model_cache or get_default_model_cache()).read(filename, **kwargs)
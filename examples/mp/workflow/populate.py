@@ -16,26 +16,62 @@ This sample can be used to run populate either on a model file (LP or SAV)
 or a DOcplex model instance.
 
 """
-from docplex.mp.model_reader import ModelReader
+from collections import namedtuple
+from concurrent.futures import ProcessPoolExecutor
+import contextlib
+import hashlib
+import io
+import itertools
+import json
+import multiprocessing
+import os
+
+from model_cache import read_model
+
+
+PoolAnalysis = namedtuple('PoolAnalysis', ['values', 'objectives', 'incumbent_diff', 'hamming', 'objective_stats'])
+PoolAnalysis.__doc__ = """ Diversity of a solution pool, as computed by `analyze_solution_pool`.
+
+    - values: solutions x variables matrix of values, columns follow `Model.iter_variables()`
+    - objectives: objective value of each solution
+    - incumbent_diff: number of variables that differ from the incumbent, for each solution
+    - hamming: solutions x solutions matrix of the number of variables that differ,
+      or None if not requested
+    - objective_stats: (count, mean, std, min, median, max) of objective values,
+      as in `SolutionPool.stats`
+"""
+
+PooledSolution = namedtuple('PooledSolution', ['model', 'objective', 'values', 'jobs'])
+PooledSolution.__doc__ = """ A solution of the merged pool returned by `populate_fan_out`.
+
+    - model: name of the model file
+    - objective: objective value
+    - values: dictionary of nonzero values by variable LP name
+    - jobs: indices of the populate jobs that found this solution
+"""
 
 
 def populate_from_file(filename, gap=0.1,
                        pool_intensity=4,
                        pool_capacity=None,
                        eps_diff=1e-7,
-                       verbose=False):
+                       verbose=False,
+                       model_cache=None):
     """ Runs populate on a model file.
 
+    The file is read through a parsed-model cache, see `model_cache.ModelCache`.
+
     :param filename: the model file.
     :param gap: MIP gap to use for the populate phase (default is 10%)
     :param pool_intensity: the value for the paramater mip.pool.intensity (defaut is 4)
     :param pool_capacity: the pool capacity (if any)
     :param eps_diff: precision to use for testing variable difference
     :param verbose: optional flag to print results.
+    :param model_cache: the model cache (default is `model_cache.get_default_model_cache()`)
 
-    :return: the solution pool as returned by `docplex.mp.Model.populate()`
+    :return: the model and the solution pool as returned by `docplex.mp.Model.populate()`
     """
-    m = ModelReader.read(filename)
+    m = read_model(filename, model_cache)
     assert m
     return populate_from_model(m, gap,
                                pool_intensity, pool_capacity, eps_diff, verbose)
@@ -56,6 +92,8 @@ def populate_from_model(mdl,
     :param eps_diff: precision to use for testing variable difference
     :param verbose: optional flag to print results.
 
+    The diversity of the pool can then be computed with `analyze_solution_pool`.
+
     :return: the model and the solution pool as returned by `docplex.mp.Model.populate()`
     """
     print(f"* running populate on model: '{mdl.name}', gap={gap}, intensity={pool_intensity}, capacity={pool_capacity}")
@@ -101,30 +139,292 @@ def populate_from_model(mdl,
     print()
     print("#solution       objective       #var diff.")
     numcols = mdl.number_of_variables
+    # solutions store their nonzero values: only variables nonzero in either solution can differ
+    incumbent_values = dict(sol.iter_var_values())
     for s, sol_i in enumerate(solnpool, start=1):
         objval_i = sol_i.objective_value
-
-        # compute the number of variables that differ in solution i and in the incumbent
-        numdiff = 0
-        for dv in mdl.iter_variables():
-            dvv_i = sol_i[dv]
-            dvv = sol[dv]
-            if abs(dvv_i - dvv) >= eps_diff:
-                numdiff += 1
+        values_i = dict(sol_i.iter_var_values())
+        numdiff = sum(1 for dv in incumbent_values.keys() | values_i.keys()
+                      if abs(values_i.get(dv, 0) - incumbent_values.get(dv, 0)) >= eps_diff)
         print("%-15s %-10g      %02d / %d" %
               (s, objval_i, numdiff, numcols))
     return mdl, solnpool
 
 
+def solution_values_matrix(mdl, solutions, columns=None):
+    """ Returns the values of a sequence of solutions, as a solutions x variables matrix.
+
+    Columns follow the order of `mdl.iter_variables()`, unless a dictionary of column
+    indices by variable is passed. Solutions only store their nonzero values, which are
+    the only ones copied.
+    """
+    import numpy as np
+    if columns is None:
+        columns = {dv: j for j, dv in enumerate(mdl.iter_variables())}
+    solutions = list(solutions)
+    values = np.zeros((len(solutions), len(columns)))
+    for s, sol in enumerate(solutions):
+        var_values = list(sol.iter_var_values())
+        values[s, [columns[dv] for dv, _ in var_values]] = [v for _, v in var_values]
+    return values
+
+
+def pairwise_hamming(values, eps_diff=1e-7, block_size=8192):
+    """ Returns the matrix of the number of differing columns between each pair of rows.
+
+    Two values differ when their distance is at least eps_diff. Columns are read by
+    blocks, so that values may be a memory-mapped array. In blocks where all values
+    are binary, the counts are computed with a matrix product.
+    """
+    import numpy as np
+    nb_rows, nb_cols = values.shape
+    hamming = np.zeros((nb_rows, nb_rows), dtype=np.int64)
+    for start in range(0, nb_cols, block_size):
+        block = np.asarray(values[:, start:start + block_size])
+        if np.all((np.abs(block) < eps_diff) | (np.abs(block - 1) < eps_diff)):
+            # |x - y| = x + y - 2xy for binary x, y
+            block = (block > 0.5).astype(np.float32)
+            ones = block.sum(axis=1)
+            hamming += np.rint(ones[:, None] + ones[None, :] - 2 * (block @ block.T)).astype(np.int64)
+        else:
+            for r in range(nb_rows):
+                hamming[r] += np.count_nonzero(np.abs(block - block[r]) >= eps_diff, axis=1)
+    return hamming
+
+
+def analyze_pool_values(values, objectives, incumbent, eps_diff=1e-7, block_size=8192, hamming=False):
+    """ Computes diversity statistics from a solutions x variables matrix of values.
+
+    :param values: the values matrix, possibly memory-mapped
+    :param objectives: objective value of each solution
+    :param incumbent: values of the incumbent solution, in the same column order
+    :param hamming: optional flag to compute the pairwise Hamming distances, see `pairwise_hamming`
+
+    :return: a `PoolAnalysis` named tuple.
+    """
+    import numpy as np
+    objectives = np.asarray(objectives, dtype=np.float64)
+    nb_solutions, nb_cols = values.shape
+    incumbent_diff = np.zeros(nb_solutions, dtype=np.int64)
+    for start in range(0, nb_cols, block_size):
+        block = np.asarray(values[:, start:start + block_size])
+        incumbent_diff += np.count_nonzero(np.abs(block - incumbent[start:start + block_size]) >= eps_diff, axis=1)
+    if nb_solutions:
+        objective_stats = (nb_solutions, float(objectives.mean()), float(objectives.std()), float(objectives.min()),
+                           float(np.sort(objectives)[nb_solutions // 2]), float(objectives.max()))
+    else:
+        objective_stats = (0, 0, 0, 1e+75, 1e+75, -1e+75)
+    return PoolAnalysis(values, objectives, incumbent_diff,
+                        pairwise_hamming(values, eps_diff, block_size) if hamming else None, objective_stats)
+
+
+def analyze_solution_pool(mdl, solnpool, eps_diff=1e-7, hamming=False):
+    """ Computes diversity statistics of a solution pool, with array operations.
+
+    :param mdl: the model instance, with its incumbent solution
+    :param solnpool: the solution pool, as returned by `docplex.mp.Model.populate_solution_pool()`
+    :param eps_diff: precision to use for testing variable difference
+    :param hamming: optional flag to compute the pairwise Hamming distances of solutions
+
+    :return: a `PoolAnalysis` named tuple.
+    """
+    values = solution_values_matrix(mdl, solnpool)
+    incumbent = solution_values_matrix(mdl, [mdl.solution])[0]
+    objectives = [sol_i.objective_value for sol_i in solnpool]
+    return analyze_pool_values(values, objectives, incumbent, eps_diff, hamming=hamming)
+
+
+# -----------------------------------------------------------------------------
+# Pool export to a memory-mappable file
+#
+# An exported pool is made of two files:
+#   <base>.npy: the solutions x variables matrix of values, in NumPy format
+#   <base>.json: the index, with the model name, objective sense,
+#                variable names (one per column) and objective values (one per row)
+# -----------------------------------------------------------------------------
+def _pool_base_path(path):
+    base, ext = os.path.splitext(path)
+    return base if ext in ('.npy', '.json') else path
+
+
+def export_solution_pool(mdl, solnpool, path, chunk_size=64):
+    """ Writes the solutions of a pool to disk, chunk_size solutions at a time.
+
+    Values are written to a memory-mapped .npy file, so that only one chunk of
+    solutions is held as a dense array.
+
+    :param mdl: the model instance
+    :param solnpool: the solution pool, or any sized sequence of solutions of mdl
+    :param path: the base path of the two files written, '.npy' and '.json' are appended
+
+    :return: the path of the .npy file
+    """
+    import numpy as np
+    base = _pool_base_path(path)
+    variables = list(mdl.iter_variables())
+    columns = {dv: j for j, dv in enumerate(variables)}
+    values = np.lib.format.open_memmap(base + '.npy', mode='w+', dtype=np.float64,
+                                       shape=(len(solnpool), len(variables)))
+    objectives = []
+    chunk = []
+    row = 0
+    for sol in solnpool:
+        chunk.append(sol)
+        objectives.append(sol.objective_value)
+        if len(chunk) == chunk_size:
+            values[row:row + len(chunk)] = solution_values_matrix(mdl, chunk, columns)
+            row += len(chunk)
+            chunk = []
+    if chunk:
+        values[row:row + len(chunk)] = solution_values_matrix(mdl, chunk, columns)
+    values.flush()
+    del values
+
+    index = {'model': mdl.name,
+             'sense': 'max' if mdl.is_maximized() else 'min',
+             'variables': [dv.lp_name for dv in variables],
+             'objectives': objectives}
+    with open(base + '.json', 'w') as index_file:
+        json.dump(index, index_file)
+    return base + '.npy'
+
+
+def load_solution_pool(path):
+    """ Reads a pool written by `export_solution_pool`.
+
+    :return: the values matrix, memory-mapped read-only, and the index dictionary.
+    """
+    import numpy as np
+    base = _pool_base_path(path)
+    values = np.load(base + '.npy', mmap_mode='r')
+    with open(base + '.json') as index_file:
+        index = json.load(index_file)
+    return values, index
+
+
+def analyze_exported_pool(path, eps_diff=1e-7, hamming=False):
+    """ Computes the diversity statistics of an exported pool, see `analyze_pool_values`.
+
+    The incumbent is the solution with the best objective value.
+    """
+    import numpy as np
+    values, index = load_solution_pool(path)
+    objectives = np.asarray(index['objectives'], dtype=np.float64)
+    best = int(np.argmax(objectives) if index['sense'] == 'max' else np.argmin(objectives))
+    return analyze_pool_values(values, objectives, np.asarray(values[best]), eps_diff, hamming=hamming)
+
+
+# -----------------------------------------------------------------------------
+# Populate on several files, or several settings, in worker processes
+# -----------------------------------------------------------------------------
+def _populate_job(job):
+    # Runs in a worker process: the pool is returned as plain data,
+    # with the log of populate_from_model.
+    filename, (gap, pool_intensity, pool_capacity), threads = job
+    out = io.StringIO()
+    with contextlib.redirect_stdout(out):
+        mdl = read_model(filename)
+        assert mdl
+        mdl.parameters.threads = threads
+        res = populate_from_model(mdl, gap, pool_intensity, pool_capacity)
+        solutions = []
+        if res:
+            solutions = [(sol.objective_value, {dv.lp_name: v for dv, v in sol.iter_var_values()})
+                         for sol in res[1]]
+        mdl.end()
+    return solutions, out.getvalue()
+
+
+def solution_hash(model, values, eps_diff=1e-7):
+    """ Returns a digest of a solution, given as a dictionary of nonzero values by variable name.
+
+    Values are rounded to eps_diff, so that solutions that differ by less hash alike
+    (except at rounding boundaries).
+    """
+    rounded = sorted((name, round(v / eps_diff)) for name, v in values.items() if round(v / eps_diff))
+    return hashlib.sha1(json.dumps([model, rounded]).encode()).hexdigest()
+
+
+def populate_fan_out(filenames, settings=None, thread_budget=None, nb_workers=None, eps_diff=1e-7,
+                     verbose=False):
+    """ Runs populate on several model files, or with several settings, in worker processes.
+
+    One job is run per (file, setting) pair. Jobs run concurrently in nb_workers processes,
+    and each populate uses thread_budget // nb_workers CPLEX threads, so that at most
+    thread_budget threads run at a time.
+
+    :param filenames: a model file, or a list of model files.
+    :param settings: a list of (gap, intensity, capacity) tuples, as in `populate_from_model`
+        (default is one job per file with the default settings).
+    :param thread_budget: the total number of threads (default is the number of cores)
+    :param nb_workers: the number of worker processes (default is the number of jobs),
+        capped at the thread budget
+    :param eps_diff: precision to use for testing variable difference
+    :param verbose: optional flag to print the log of each job.
+
+    :return: a dictionary of `PooledSolution` by solution hash, where solutions found
+        by several jobs appear once.
+    """
+    if isinstance(filenames, str):
+        filenames = [filenames]
+    if settings is None:
+        settings = [(0.1, 4, None)]
+    if thread_budget is None:
+        thread_budget = os.cpu_count() or 1
+    jobs = list(itertools.product(filenames, settings))
+    if thread_budget < 1:
+        raise ValueError(f"Thread budget must be at least 1, {thread_budget} was passed")
+    # each worker uses one thread at least, so that there are at most thread_budget workers
+    nb_workers = min(nb_workers or len(jobs), thread_budget)
+    threads = max(1, thread_budget // nb_workers)
+    print(f"* running {len(jobs)} populate jobs in {nb_workers} processes, {threads} threads each")
+
+    pool = None
+    if nb_workers > 1:
+        pool = ProcessPoolExecutor(nb_workers, mp_context=multiprocessing.get_context('spawn'))
+        run_jobs = pool.map
+    else:
+        run_jobs = map
+    merged = {}
+    try:
+        for j, (solutions, log) in enumerate(run_jobs(_populate_job, [job + (threads,) for job in jobs])):
+            filename, (gap, pool_intensity, pool_capacity) = jobs[j]
+            if verbose:
+                print(log)
+            nb_new = 0
+            for objective, values in solutions:
+                key = solution_hash(filename, values, eps_diff)
+                if key in merged:
+                    merged[key].jobs.append(j)
+                else:
+                    merged[key] = PooledSolution(filename, objective, values, [j])
+                    nb_new += 1
+            print(f"-- job #{j}: '{filename}', gap={gap}, intensity={pool_intensity}, capacity={pool_capacity}:"
+                  f" {len(solutions)} solutions, {nb_new} new")
+    finally:
+        if pool is not None:
+            pool.shutdown()
+    print(f"* merged pool contains {len(merged)} distinct solutions")
+    return merged
+
+
 if __name__ == "__main__":
     from os.path import abspath, dirname, join
     import sys
 
+    if len(sys.argv) > 1 and sys.argv[1] == "--fan-out":
+        # --fan-out <file> [<file> ...]: one populate job per file, in worker processes
+        populate_fan_out(sys.argv[2:])
+        sys.exit(0)
     if len(sys.argv) == 1:
         filename = join(dirname(abspath(__file__)), "sports.lp")
     else:
         filename = sys.argv[1]
     mdl, sol_pool = populate_from_file(filename)
+    if len(sys.argv) > 2:
+        # second argument: base path of the exported pool files
+        npy_path = export_solution_pool(mdl, sol_pool, sys.argv[2])
+        print("* pool exported to: {0}".format(npy_path))
     mdl.end()
 
 
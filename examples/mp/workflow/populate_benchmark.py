@@ -0,0 +1,79 @@
+# --------------------------------------------------------------------------
+# Source file provided under Apache License, Version 2.0, January 2004,
+# http://www.apache.org/licenses/
+# (c) Copyright IBM Corp. 2015, 2022
+# --------------------------------------------------------------------------
+
+"""
+Benchmarks for the solution pool analysis and export of the populate example (populate.py).
+
+Usage:
+    python populate_benchmark.py export [model_file [base_path]]: export a pool, check it reads back
+    python populate_benchmark.py analysis [nb_solutions [nb_variables]]: analysis of a random binary pool
+"""
+
+import os
+import sys
+import tempfile
+import time
+
+import numpy as np
+
+from populate import populate_from_file, analyze_solution_pool, analyze_pool_values, export_solution_pool, \
+    load_solution_pool, analyze_exported_pool
+
+
+def bench_export(filename, base_path=None):
+    """ Runs populate on a model file, exports the pool and reads it back.
+
+    The pool is read from the path of both exported files, and checked against the pool
+    in memory: values, objectives and analysis must be the same.
+    """
+    mdl, solnpool = populate_from_file(filename)
+    if base_path is None:
+        base_path = os.path.join(tempfile.mkdtemp(), mdl.name)
+    t0 = time.perf_counter()
+    analysis = analyze_solution_pool(mdl, solnpool, hamming=True)
+    t1 = time.perf_counter()
+    npy_path = export_solution_pool(mdl, solnpool, base_path)
+    t2 = time.perf_counter()
+    print('* analysis: {0:.3f}s, export: {1:.3f}s, to {2}'.format(t1 - t0, t2 - t1, npy_path))
+    for pool_path in (npy_path, os.path.splitext(npy_path)[0] + '.json'):
+        values, index = load_solution_pool(pool_path)
+        same_values = values.shape == analysis.values.shape and np.array_equal(values, analysis.values)
+        same_objectives = index['objectives'] == [sol.objective_value for sol in solnpool]
+        print('-- read from {0}: values {1}, objectives {2}'.format(
+            pool_path, 'ok' if same_values else 'DIFFER', 'ok' if same_objectives else 'DIFFER'))
+    t3 = time.perf_counter()
+    exported = analyze_exported_pool(npy_path, hamming=True)
+    t4 = time.perf_counter()
+    print('-- analysis of the exported pool: {0:.3f}s, Hamming distances {1}'.format(
+        t4 - t3, 'ok' if np.array_equal(exported.hamming, analysis.hamming) else 'DIFFER'))
+    mdl.end()
+
+
+def bench_analysis(nb_solutions=1000, nb_variables=100000, density=0.05, seed=0):
+    """ Times the analysis of a random pool of binary solutions, with and without Hamming distances. """
+    rng = np.random.default_rng(seed)
+    values = (rng.random((nb_solutions, nb_variables)) < density).astype(np.float64)
+    objectives = rng.random(nb_solutions)
+    print('| {:>10} | {:>10} | {:>8} | {:>8} |'.format('#solutions', '#variables', 'hamming', 'time (s)'))
+    for hamming in (False, True):
+        t0 = time.perf_counter()
+        analyze_pool_values(values, objectives, values[0], hamming=hamming)
+        print('| {:>10} | {:>10} | {:>8} | {:>8.3f} |'.format(
+            nb_solutions, nb_variables, str(hamming), time.perf_counter() - t0))
+
+
+if __name__ == '__main__':
+    bench = sys.argv[1] if len(sys.argv) > 1 else 'export'
+    if bench == 'export':
+        model_file = sys.argv[2] if len(sys.argv) > 2 else os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                                                                        'sports.lp')
+        bench_export(model_file, sys.argv[3] if len(sys.argv) > 3 else None)
+    elif bench == 'analysis':
+        bench_analysis(int(sys.argv[2]) if len(sys.argv) > 2 else 1000,
+                       int(sys.argv[3]) if len(sys.argv) > 3 else 100000)
+    else:
+        print('Usage: {} export [model_file [base_path]] | analysis [nb_solutions [nb_variables]]'
+              .format(sys.argv[0]))